@@ -0,0 +1,154 @@
+import numpy as np
+import argparse
+import contextlib
+import difflib
+import io
+import itertools
+import os
+import tempfile
+import time
+import wave
+from pymorse.pymorse import MORSE, File_decoder, options
+
+SAMPLE_RATE = 12000
+LEAD_SECS = 3
+PREAMBLE = 'VVV'
+PREAMBLE_GAP_SECS = 4
+TEXT = 'CQ CQ DE G1OJS G1OJS K TNX FER CALL UR RST 599 599 NAME IS JOHN QTH NR LONDON HW CPY 73'
+
+C2M = {}
+for code, char in MORSE.items():
+    C2M.setdefault(char, code)
+
+class Encoder:
+    def __init__(self, sample_rate = SAMPLE_RATE, rise_ms = 5):
+        self.sample_rate = sample_rate
+        self.edge = np.hanning(int(2 * rise_ms * sample_rate / 1000) + 1)
+        self.edge /= np.sum(self.edge)
+
+    def keying(self, text, wpm, jitter, rng):
+        # returns the key envelope and the end time of each word
+        tu = 1.2 / wpm
+        durs, word_ends = [], []
+        for word in text.split(' '):
+            for char in word:
+                code = C2M[char]
+                for iel, el in enumerate(code):
+                    durs += [(1, 1 if el == '.' else 3), (0, 1 if iel < len(code) - 1 else 3)]
+            durs[-1] = (0, 7)
+            word_ends.append((word, len(durs) - 1))
+        lengths = np.array([d for k, d in durs]) * tu * (1 + jitter * rng.standard_normal(len(durs)))
+        lengths = np.maximum(lengths, tu / 4)
+        edges = np.concatenate(([0], np.cumsum(lengths)))
+        key = np.zeros(int(edges[-1] * self.sample_rate) + 1)
+        for (k, d), t0, t1 in zip(durs, edges[:-1], edges[1:]):
+            if(k):
+                key[int(t0 * self.sample_rate):int(t1 * self.sample_rate)] = 1
+        word_ends = [(word, edges[i]) for word, i in word_ends]
+        return np.convolve(key, self.edge, mode = 'same'), word_ends
+
+class Channel:
+    def __init__(self, sample_rate = SAMPLE_RATE):
+        self.sample_rate = sample_rate
+
+    def fade(self, n, fade_hz, rng):
+        if(fade_hz <= 0):
+            return np.ones(n)
+        n_pts = int(n / self.sample_rate * fade_hz * 4) + 2
+        g = rng.standard_normal(n_pts) + 1j * rng.standard_normal(n_pts)
+        g = np.abs(np.interp(np.linspace(0, n_pts - 1, n), np.arange(n_pts), g.real) +
+                   1j * np.interp(np.linspace(0, n_pts - 1, n), np.arange(n_pts), g.imag))
+        return g / np.sqrt(np.mean(g * g))
+
+    def transmit(self, key, freq, snr_db, fade_hz, rng):
+        # snr is measured in a 2500 Hz bandwidth, as usual for amateur radio
+        n = len(key)
+        t = np.arange(n) / self.sample_rate
+        sig = key * self.fade(n, fade_hz, rng) * np.sin(2 * np.pi * freq * t)
+        noise_var = 0.5 / 10**(snr_db / 10) * (self.sample_rate / 2) / 2500
+        audio = sig + np.sqrt(noise_var) * rng.standard_normal(n)
+        return (audio / np.max(np.abs(audio)) * 20000).astype(np.int16)
+
+def edit_distance(a, b):
+    d = np.arange(len(b) + 1)
+    for i, ca in enumerate(a, 1):
+        prev, d[0] = d[0], i
+        for j, cb in enumerate(b, 1):
+            prev, d[j] = d[j], min(d[j] + 1, d[j - 1] + 1, prev + (ca != cb))
+    return d[-1]
+
+def run_cell(text, wpm, snr_db, fade_hz, jitter, freq, df, freq_range, n_decoders, engine, seed, decoder = 'timing'):
+    rng = np.random.default_rng(seed)
+    encoder, channel = Encoder(), Channel()
+    # the preamble lets the decoder find the signal and its speed. The gap after it is longer than
+    # any decoder's word timeout and latency, so the words decoded before the text starts are the
+    # preamble's, whatever they are and however late they come
+    preamble, _ = encoder.keying(PREAMBLE, wpm, jitter, rng)
+    key, word_ends = encoder.keying(text, wpm, jitter, rng)
+    body_start = LEAD_SECS + len(preamble) / SAMPLE_RATE + PREAMBLE_GAP_SECS
+    word_ends = [(w, body_start + t) for w, t in word_ends]
+    key = np.concatenate((np.zeros(LEAD_SECS * SAMPLE_RATE), preamble, np.zeros(PREAMBLE_GAP_SECS * SAMPLE_RATE), key, np.zeros(LEAD_SECS * SAMPLE_RATE)))
+    audio = channel.transmit(key, freq, snr_db, fade_hz, rng)
+    handle, path = tempfile.mkstemp(suffix = '.wav')
+    os.close(handle)
+    try:
+        with wave.open(path, 'wb') as w:
+            w.setnchannels(1)
+            w.setsampwidth(2)
+            w.setframerate(SAMPLE_RATE)
+            w.writeframes(audio.tobytes())
+        with contextlib.redirect_stdout(io.StringIO()):
+            fd = File_decoder(path, options(freq_range = freq_range, df = df, n_decoders = n_decoders, engine = engine, decoder = decoder))
+        fbin = int(round(freq / fd.spectrum.params['df'])) - fd.spectrum.fBins[0]
+        words = []
+        def on_event(fb, event, text):
+            if(event == 'word' and fb == fbin):
+                words.append((fd.bank.t, text))
+        fd.bank.listeners.append(on_event)
+        t0 = time.time()
+        audio_secs = fd.run()
+        run_secs = time.time() - t0
+    finally:
+        os.remove(path)
+    words = [(t, w) for t, w in words if t > body_start]
+    decoded = ' '.join(w for t, w in words)
+    cer = edit_distance(decoded, text) / len(text)
+    matcher = difflib.SequenceMatcher(None, [w for w, t in word_ends], [w for t, w in words], autojunk = False)
+    latencies = [words[j + k][0] - word_ends[i + k][1] for i, j, n in matcher.get_matching_blocks() for k in range(n)]
+    latency = np.mean(latencies) if latencies else np.nan
+    return cer, latency, audio_secs / run_secs, decoded
+
+def csv_floats(s):
+    return [float(v) for v in s.split(',')]
+
+def cli():
+    parser = argparse.ArgumentParser(prog='pymorse-loopback', description = 'Decode synthetic morse over a grid of conditions and report character error rate and latency')
+    parser.add_argument('--wpm', help = 'Comma-separated speeds, wpm', type = csv_floats, default = [15, 20, 25, 30])
+    parser.add_argument('--snr', help = 'Comma-separated SNRs in 2500 Hz, dB', type = csv_floats, default = [10, 0, -5, -10])
+    parser.add_argument('--fade', help = 'Comma-separated fading rates, Hz (0 for none)', type = csv_floats, default = [0, 0.5])
+    parser.add_argument('--jitter', help = 'Comma-separated element timing jitter, fraction of element length', type = csv_floats, default = [0, 0.1])
+    parser.add_argument('--text', help = 'Text to send', default = TEXT)
+    parser.add_argument('--freq', help = 'Tone frequency, Hz', type = float, default = 600)
+    parser.add_argument('-df', '--df', help = 'Frequency step, Hz', type = float, default = 40)
+    parser.add_argument('-fr', '--freq_range', help = 'Frequency range Hz', type = csv_floats, default = [200, 800])
+    parser.add_argument('-n', '--n_decoders', help = 'Number of decoders', type = int, default = 3)
+    parser.add_argument('-e', '--engine', help = 'Spectrum engine', choices = ['fft','sdft','pfb'], default = 'fft')
+    parser.add_argument('-d', '--decoder', help = 'Decoder', choices = ['timing','correl'], default = 'timing')
+    parser.add_argument('-s', '--seed', help = 'Random seed', type = int, default = 1)
+    parser.add_argument('-v', '--verbose', help = 'Show the decoded text for each cell', action = 'store_true')
+    args = parser.parse_args()
+
+    print(f"{'wpm':>5} {'snr':>5} {'fade':>5} {'jitter':>6} | {'CER':>6} {'latency':>8} {'x realtime':>10}")
+    cers = []
+    for wpm, snr, fade, jitter in itertools.product(args.wpm, args.snr, args.fade, args.jitter):
+        cer, latency, speedup, decoded = run_cell(args.text.upper(), wpm, snr, fade, jitter, args.freq, args.df,
+                                                  args.freq_range, args.n_decoders, args.engine, args.seed, args.decoder)
+        cers.append(cer)
+        latency = f"{latency:7.2f}s" if np.isfinite(latency) else f"{'-':>8}"
+        print(f"{wpm:5.0f} {snr:5.0f} {fade:5.1f} {jitter:6.2f} | {cer:6.1%} {latency} {speedup:9.0f}x")
+        if(args.verbose):
+            print(f"      {decoded}")
+    print(f"Mean CER {np.mean(cers):.1%} over {len(cers)} cells")
+
+if __name__ == '__main__':
+    cli()
@@ -0,0 +1,152 @@
+# Generated by utils/dictionary_generator.py - do not edit
+
+MORSE_MAX_LEN = 9
+
+MORSE = {
+'.-': 'A', '-...': 'B', '-.-.': 'C', '-..': 'D', '.': 'E', '..-.': 'F', '--.': 'G', '....': 'H', '..': 'I', '.---': 'J',
+'-.-': 'K', '.-..': 'L', '--': 'M', '-.': 'N', '---': 'O', '.--.': 'P', '--.-': 'Q', '.-.': 'R', '...': 'S', '-': 'T',
+'..-': 'U', '...-': 'V', '.--': 'W', '-..-': 'X', '-.--': 'Y', '--..': 'Z', '-----': '0', '.----': '1', '..---': '2', '...--': '3',
+'....-': '4', '.....': '5', '-....': '6', '--...': '7', '---..': '8', '----.': '9', '-..-.': '/', '..--': 'Ü', '-.-.-': '_AR_', '.-.-.': '_AR_',
+'..--..': '?', '-...-': '_BK_', '...-.-': '_SK_', '..-.-.': '_UR_', '-.--.': '_KN_', '-.-.--.-': '_CQ_', '...-.': 'P', '.-..-': 'J', '.--..': 'J', '.-...': 'P',
+'..-.-': 'Q', '-.-..': 'Y', '..-..': 'Ü', '..----': '0', '-..---': '0', '--..--': '0', '---..-': '0', '----..': '0', '...---': '1', '.-..--': '1',
+'.--..-': '1', '.---..': '1', '....--': '2', '..-..-': '2', '.....-': '_BK_', '...-..': '3', '......': '6', '..-...': '7', '-.....': '_BK_', '-..-..': '8',
+'--....': '8', '..---.': '9', '-..--.': '9', '--..-.': '9', '---...': '9', '....-.': '_AR_', '-....-': '_AR_', '-.-...': '_KN_', '.-....': '_AR_', '....-..': '?',
+'..-....': '_UR_', '......-': '_SK_', '...-...': '_SK_', '.....-.': '_UR_', '...--.': '_KN_', '-...-.': '_KN_', '...-.--.-': '_CQ_', '-....--.-': '_CQ_', '-.-...-.-': '_CQ_', '-.-.-...-': '_CQ_',
+'-.-.--...': '_CQ_',
+}
+
+# MORSE indexed by packed code: elements as bits (dash = 1) below a leading 1
+MORSE_TABLE = [
+'', '', 'E', 'T', 'I', 'A', 'N', 'M', 'S', 'U', 'R', 'W', 'D', 'K', 'G', 'O',
+'H', 'V', 'F', 'Ü', 'L', '', 'P', 'J', 'B', 'X', 'C', 'Y', 'Z', 'Q', '', '',
+'5', '4', 'P', '3', 'Ü', 'Q', '', '2', 'P', 'J', '_AR_', '', 'J', '', '', '1',
+'6', '_BK_', '/', '', 'Y', '_AR_', '_KN_', '', '7', '', '', '', '8', '', '9', '0',
+'6', '_BK_', '_AR_', '2', '3', '_SK_', '_KN_', '1', '7', '2', '_UR_', '', '?', '', '9', '0',
+'_AR_', '', '', '1', '', '', '', '', '', '1', '', '', '1', '', '', '',
+'_BK_', '_AR_', '_KN_', '', '8', '', '9', '0', '_KN_', '', '', '', '', '', '', '',
+'8', '', '9', '0', '', '', '', '', '9', '0', '', '', '0', '', '', '',
+'', '_SK_', '_UR_', '', '?', '', '', '', '_SK_', '', '', '', '', '', '', '',
+'_UR_', '', '', '', '', '', '', '', '', '', '', '', '', '', '', '',
+'', '', '', '', '', '', '', '', '', '', '', '', '', '', '', '',
+'', '', '', '', '', '', '', '', '', '', '', '', '', '', '', '',
+'', '', '', '', '', '', '', '', '', '', '', '', '', '', '', '',
+'', '', '', '', '', '', '', '', '', '', '', '', '', '', '', '',
+'', '', '', '', '', '', '', '', '', '', '', '', '', '', '', '',
+'', '', '', '', '', '', '', '', '', '', '', '', '', '', '', '',
+'', '', '', '', '', '', '', '', '', '', '', '', '', '', '', '',
+'', '', '', '', '', '', '', '', '', '', '', '', '', '', '', '',
+'', '', '', '', '', '', '', '', '', '', '', '', '', '', '', '',
+'', '', '', '', '', '', '', '', '', '', '', '', '', '', '', '',
+'', '', '', '', '', '', '', '', '', '', '', '', '', '', '', '',
+'', '', '', '', '', '', '', '', '', '', '', '', '', '', '', '',
+'', '', '', '', '', '', '', '', '', '', '', '', '', '', '', '',
+'', '', '', '', '', '', '', '', '', '', '', '', '', '', '', '',
+'', '', '', '', '', '', '', '', '', '', '', '', '', '', '', '',
+'', '', '', '', '', '', '', '', '', '', '', '', '', '', '', '',
+'', '', '', '', '', '', '', '', '', '', '', '', '', '_CQ_', '', '',
+'', '', '', '', '', '', '', '', '', '', '', '', '', '', '', '',
+'', '', '', '', '', '', '', '', '', '', '', '', '', '', '', '',
+'', '', '', '', '', '', '', '', '', '', '', '', '', '', '', '',
+'', '', '', '', '', '', '', '', '', '', '', '', '', '', '', '',
+'', '', '', '', '', '', '', '', '', '', '', '', '', '', '', '',
+'', '', '', '', '', '', '', '', '', '', '', '', '', '', '', '',
+'', '', '', '', '', '', '', '', '', '', '', '', '', '', '', '',
+'', '', '', '', '', '', '', '', '', '', '', '', '', '_CQ_', '', '',
+'', '', '', '', '', '', '', '', '', '', '', '', '', '', '', '',
+'', '', '', '', '', '', '', '', '', '', '', '', '', '', '', '',
+'', '', '', '', '', '', '', '', '', '', '', '', '', '', '', '',
+'', '', '', '', '', '', '', '', '', '', '', '', '', '', '', '',
+'', '', '', '', '', '', '', '', '', '', '', '', '', '', '', '',
+'', '', '', '', '', '', '', '', '', '', '', '', '', '', '', '',
+'', '', '', '', '', '', '', '', '', '', '', '', '', '', '', '',
+'', '', '', '', '', '', '', '', '', '', '', '', '', '', '', '',
+'', '', '', '', '', '', '', '', '', '', '', '', '', '', '', '',
+'', '', '', '', '', '', '', '', '', '', '', '', '', '', '', '',
+'', '', '', '', '', '', '', '', '', '', '', '', '', '', '', '',
+'', '', '', '', '', '', '', '', '', '', '', '', '', '', '', '',
+'', '', '', '', '', '', '', '', '', '', '', '', '', '', '', '',
+'', '', '', '', '', '', '', '', '', '', '', '', '', '_CQ_', '', '',
+'', '', '', '', '', '', '', '', '', '', '', '', '', '', '', '',
+'', '', '', '', '', '', '', '', '', '', '', '', '', '', '', '',
+'', '', '', '', '', '', '', '', '', '', '', '', '', '', '', '',
+'', '', '', '', '', '_CQ_', '', '', '', '', '', '', '', '', '', '',
+'', '_CQ_', '', '', '', '', '', '', '_CQ_', '', '', '', '', '', '', '',
+'', '', '', '', '', '', '', '', '', '', '', '', '', '', '', '',
+'', '', '', '', '', '', '', '', '', '', '', '', '', '', '', '',
+'', '', '', '', '', '', '', '', '', '', '', '', '', '', '', '',
+'', '', '', '', '', '', '', '', '', '', '', '', '', '', '', '',
+'', '', '', '', '', '', '', '', '', '', '', '', '', '', '', '',
+'', '', '', '', '', '', '', '', '', '', '', '', '', '', '', '',
+'', '', '', '', '', '', '', '', '', '', '', '', '', '', '', '',
+'', '', '', '', '', '', '', '', '', '', '', '', '', '', '', '',
+'', '', '', '', '', '', '', '', '', '', '', '', '', '', '', '',
+'', '', '', '', '', '', '', '', '', '', '', '', '', '', '', '',
+]
+
+# MORSE_TABLE plus unknown codes matched to a unique nearest code within 2 elements
+MORSE_NEAREST = [
+'', '', 'E', 'T', 'I', 'A', 'N', 'M', 'S', 'U', 'R', 'W', 'D', 'K', 'G', 'O',
+'H', 'V', 'F', 'Ü', 'L', '', 'P', 'J', 'B', 'X', 'C', 'Y', 'Z', 'Q', '', '',
+'5', '4', 'P', '3', 'Ü', 'Q', '', '2', 'P', 'J', '_AR_', '', 'J', '1', '', '1',
+'6', '_BK_', '/', '', 'Y', '_AR_', '_KN_', '', '7', '', '', '0', '8', '', '9', '0',
+'6', '_BK_', '_AR_', '2', '3', '_SK_', '_KN_', '1', '7', '2', '_UR_', '_UR_', '?', '', '9', '0',
+'_AR_', '_SK_', '_UR_', '1', '', '_SK_', '', '_SK_', '', '1', '_UR_', '_UR_', '1', '', '', '',
+'_BK_', '_AR_', '_KN_', '', '8', '_SK_', '9', '0', '_KN_', '', '_UR_', '_UR_', '?', '', '', '',
+'8', '', '9', '0', '', '_SK_', '', '', '9', '0', '_UR_', '', '0', '', '', '',
+'', '_SK_', '_UR_', '', '?', '', '', '', '_SK_', '', '', '', '', '', '', '',
+'_UR_', '', '', '', '', '', '', '', '', '', '', '', '', '', '', '',
+'', '', '', '', '', '', '', '', '', '', '', '', '', '', '', '',
+'', '', '', '', '', '', '', '', '', '', '', '', '', '', '', '',
+'', '', '', '', '', '', '', '', '', '', '', '', '', '', '', '',
+'', '', '', '', '', '', '', '', '', '', '', '', '', '', '', '',
+'', '', '', '', '', '', '', '', '', '', '', '', '', '', '', '',
+'', '', '', '', '', '', '', '', '', '', '', '', '', '', '', '',
+'', '', '', '', '', '', '', '', '', '', '', '', '', '_CQ_', '', '',
+'', '', '', '', '', '', '', '', '', '', '', '', '', '', '', '',
+'', '', '', '', '', '_CQ_', '', '', '', '_CQ_', '', '', '_CQ_', '_CQ_', '', '_CQ_',
+'', '', '', '', '', '', '', '', '', '', '', '', '', '_CQ_', '', '',
+'', '', '', '', '', '', '', '', '', '', '', '', '', '', '', '',
+'', '', '', '', '', '', '', '', '', '', '', '', '', '', '', '',
+'', '', '', '', '', '', '', '', '', '', '', '', '', '_CQ_', '', '',
+'', '', '', '', '', '', '', '', '', '', '', '', '', '', '', '',
+'', '', '', '', '', '_CQ_', '', '', '', '_CQ_', '', '', '_CQ_', '_CQ_', '', '_CQ_',
+'', '', '', '', '', '', '', '', '', '', '', '', '', '_CQ_', '', '',
+'', '_CQ_', '', '', '_CQ_', '_CQ_', '', '_CQ_', '_CQ_', '_CQ_', '', '_CQ_', '_CQ_', '_CQ_', '_CQ_', '_CQ_',
+'', '', '', '', '', '_CQ_', '', '', '', '_CQ_', '', '', '_CQ_', '_CQ_', '', '_CQ_',
+'', '', '', '', '', '', '', '', '', '', '', '', '', '_CQ_', '', '',
+'', '', '', '', '', '', '', '', '', '', '', '', '', '', '', '',
+'', '', '', '', '', '_CQ_', '', '', '', '_CQ_', '', '', '_CQ_', '_CQ_', '', '_CQ_',
+'', '', '', '', '', '', '', '', '', '', '', '', '', '_CQ_', '', '',
+'', '', '', '', '', '', '', '', '', '', '', '', '', '', '', '',
+'', '', '', '', '', '', '', '', '', '', '', '', '', '', '', '',
+'', '', '', '', '', '', '', '', '', '', '', '', '', '_CQ_', '', '',
+'', '', '', '', '', '', '', '', '', '', '', '', '', '', '', '',
+'', '', '', '', '', '', '', '', '', '', '', '', '', '', '', '',
+'', '', '', '', '', '', '', '', '', '', '', '', '', '', '', '',
+'', '', '', '', '', '', '', '', '', '', '', '', '', '', '', '',
+'', '', '', '', '', '', '', '', '', '', '', '', '', '', '', '',
+'', '', '', '', '', '', '', '', '', '', '', '', '', '', '', '',
+'', '', '', '', '', '', '', '', '', '', '', '', '', '', '', '',
+'', '', '', '', '', '', '', '', '', '', '', '', '', '', '', '',
+'', '', '', '', '', '', '', '', '', '', '', '', '', '', '', '',
+'', '', '', '', '', '', '', '', '', '', '', '', '', '', '', '',
+'', '', '', '', '', '', '', '', '', '', '', '', '', '', '', '',
+'', '', '', '', '', '', '', '', '', '', '', '', '', '', '', '',
+'', '', '', '', '', '', '', '', '', '', '', '', '', '', '', '',
+'', '', '', '', '', '', '', '', '', '', '', '', '', '_CQ_', '', '',
+'', '', '', '', '', '', '', '', '', '', '', '', '', '', '', '',
+'', '', '', '', '', '', '', '', '', '', '', '', '', '', '', '',
+'', '', '', '', '', '', '', '', '', '', '', '', '', '', '', '',
+'', '', '', '', '', '_CQ_', '', '', '', '', '', '', '', '', '', '',
+'', '_CQ_', '', '', '', '', '', '', '_CQ_', '', '', '', '', '', '', '',
+'', '', '', '', '', '', '', '', '', '', '', '', '', '', '', '',
+'', '', '', '', '', '', '', '', '', '', '', '', '', '', '', '',
+'', '', '', '', '', '', '', '', '', '', '', '', '', '', '', '',
+'', '', '', '', '', '', '', '', '', '', '', '', '', '', '', '',
+'', '', '', '', '', '', '', '', '', '', '', '', '', '', '', '',
+'', '', '', '', '', '', '', '', '', '', '', '', '', '', '', '',
+'', '', '', '', '', '', '', '', '', '', '', '', '', '', '', '',
+'', '', '', '', '', '', '', '', '', '', '', '', '', '', '', '',
+'', '', '', '', '', '', '', '', '', '', '', '', '', '', '', '',
+'', '', '', '', '', '', '', '', '', '', '', '', '', '', '', '',
+]
@@ -3,31 +3,79 @@ import struct
 import time
 import threading
 import random
+import collections
 
 MAX_REPORTS = 90
+REPORT_SECS = 300
+CHECK_SECS = 5
+MAX_PAYLOAD = 1400
+DNS_TTL_SECS = 3600
+RETRY = {'MAX_PACKETS':32, 'ATTEMPTS':5, 'BACKOFF_SECS':30}
+SPOTS = {'WINDOW_SECS':REPORT_SECS, 'TTL_SECS':2 * REPORT_SECS, 'MAX':5000}
+BANDS = {'160m':(1.8e6, 2.0e6), '80m':(3.5e6, 4.0e6), '60m':(5.25e6, 5.45e6), '40m':(7.0e6, 7.3e6), '30m':(10.1e6, 10.15e6),
+         '20m':(14.0e6, 14.35e6), '17m':(18.068e6, 18.168e6), '15m':(21.0e6, 21.45e6), '12m':(24.89e6, 24.99e6),
+         '10m':(28.0e6, 29.7e6), '6m':(50e6, 54e6), '2m':(144e6, 148e6), '70cm':(420e6, 450e6)}
+
+def band(freq_hz):
+    for name, (lo, hi) in BANDS.items():
+        if(lo <= freq_hz <= hi):
+            return name
+    return f"{int(freq_hz // 1e6)}MHz"
+
+class Spot_index:
+    # the spots seen recently, keyed by (callsign, band, time bucket) in least recently seen first
+    # order: entries older than ttl_secs, and the oldest beyond max_spots, are evicted
+    def __init__(self, max_spots = SPOTS['MAX'], ttl_secs = SPOTS['TTL_SECS']):
+        self.max_spots, self.ttl_secs = max_spots, ttl_secs
+        self.spots = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self.spots)
+
+    def seen(self, key, now):
+        # whether key was already in the index, adding or refreshing it, and the keys evicted
+        was_seen = key in self.spots
+        self.spots[key] = now
+        self.spots.move_to_end(key)
+        evicted = []
+        while self.spots:
+            oldest, t = next(iter(self.spots.items()))
+            if(len(self.spots) <= self.max_spots and now - t <= self.ttl_secs):
+                break
+            del self.spots[oldest]
+            evicted.append(oldest)
+        return was_seen, evicted
 
 class PSKR_upload:
     # https://pskreporter.info/pskdev.html
     # https://pskreporter.info/cgi-bin/psk-analysis.pl
-    def __init__(self, mycall, mygrid, software, console_print):
+    # add_report only stores the spot; a sender thread swaps the reports out under the lock, packs
+    # them into packets of at most MAX_PAYLOAD bytes and sends them to the cached server address,
+    # keeping packets that fail to send in a bounded queue to try again later. Each spot (callsign,
+    # band and SPOTS['WINDOW_SECS'] window) is uploaded once; repeats only update it until it is sent
+    def __init__(self, mycall, mygrid, software, console_print, addr = ("report.pskreporter.info", 4739)):
         self.RxInfoRecDescriptor_CallLocSoft = b"\x00\x03\x00\x24\x99\x92\x00\x03\x00\x01\x80\x02\xFF\xFF\x00\x00\x76\x8F\x80\x04\xFF\xFF\x00\x00\x76\x8F\x80\x08\xFF\xFF\x00\x00\x76\x8F\x00\x00"
         self.SenderInfoRecDescriptor_SenderFreqSNRiMDModeSourceTime = b"\x00\x02\x00\x3C\x99\x93\x00\x07\x80\x01\xFF\xFF\x00\x00\x76\x8F\x80\x05\x00\x04\x00\x00\x76\x8F\x80\x06\x00\x01\x00\x00\x76\x8F\x80\x07\x00\x01\x00\x00\x76\x8F\x80\x0A\xFF\xFF\x00\x00\x76\x8F\x80\x0B\x00\x01\x00\x00\x76\x8F\x00\x96\x00\x04"
         self.last_descriptors_time = 0
         self.descriptors_sent_count = 0
-        self.last_report_time = time.time() - 300 + 60
-        self.addr = ("report.pskreporter.info", 4739)
+        self.last_report_time = time.time() - REPORT_SECS + 60
+        self.addr = addr
+        self.resolved, self.resolved_time = None, 0
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        #HOST = socket.gethostbyname(socket.gethostname())
-        #self.sock.bind((HOST, 1234))
         self.session_id = random.getrandbits(32)
         self.seq = 1
         self.reports = {}
+        self.spots = Spot_index()
+        self.retries = collections.deque(maxlen = RETRY['MAX_PACKETS'])
         rx = self._enc_str(mycall) + self._enc_str(mygrid) + self._enc_str(software)
         self.rx_block =  self._block(b"\x99\x92", rx)
         self.console_print = console_print
         self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.force, self.stopped = False, False
         print(f"[PSKR_upload] Spots will upload to pskreporter")
-        threading.Thread(target = self._check_for_send, daemon = True).start()
+        self.thread = threading.Thread(target = self._check_for_send, daemon = True)
+        self.thread.start()
 
     def _enc_str(self, s):
         b = s.encode("ascii")
@@ -38,48 +86,127 @@ class PSKR_upload:
         pad_len = (4 - (len_with_header % 4)) % 4
         len_with_pad = len_with_header + pad_len
         blk = block_type + struct.pack("!H", len_with_pad) + payload + b"\x00" * pad_len
-        return blk 
+        return blk
 
     def add_report(self, dxcall, freq_hz, snr, mode, source, tt):
+        key = (dxcall, band(freq_hz), tt // SPOTS['WINDOW_SECS'])
         with self.lock:
-            self.reports[dxcall] = (dxcall, freq_hz, snr, mode, source, (tt // 15) * 15)
+            was_seen, evicted = self.spots.seen(key, time.time())
+            for k in evicted:
+                self.reports.pop(k, None)
+            if(not was_seen or key in self.reports):
+                self.reports[key] = (dxcall, freq_hz, snr, mode, source, (tt // 15) * 15)
+            full = len(self.reports) >= MAX_REPORTS
+        if(full):
+            self.wake.set()
+
+    def flush(self):
+        # send whatever is waiting now, including packets queued for retry
+        self.force = True
+        self.wake.set()
+
+    def close(self):
+        self.stopped = True
+        self.wake.set()
+        self.thread.join(5)
+        self._upload(force = True)
 
     def _check_for_send(self):
-        while True:
-            time.sleep(60)
-            with self.lock:
-                if len(self.reports) >= MAX_REPORTS or (time.time() - self.last_report_time) > 300:
-                    if (time.time() - self.last_descriptors_time) > 3600:
-                        self.descriptors_sent_count = 0
-                        self.last_descriptors_time = time.time()
-                    self._send(includeDescriptors = (self.descriptors_sent_count <4))
-                    self.descriptors_sent_count +=1
-           
-    def _send(self, includeDescriptors = False):
-        if not self.reports:
-            return
-        tt = int(time.time())
-        ipfx_header = struct.pack("!H", 10) + b"\x00\x00" + struct.pack("!I", tt) + struct.pack("!I", self.seq) + struct.pack("!I", self.session_id)
-        header = ipfx_header
-        if includeDescriptors:
-            print(f"[pskr_upload] Packing descriptors")
-            header = header + self.RxInfoRecDescriptor_CallLocSoft + self.SenderInfoRecDescriptor_SenderFreqSNRiMDModeSourceTime
-        senders = bytearray()
-        for dxcall, freq_hz, snr, mode, source, tt in self.reports.values():
-            print(f"[pskr_upload] Packing report {dxcall}, {freq_hz}, {snr}, {mode}, {source}, {tt}")
+        while not self.stopped:
+            self.wake.wait(CHECK_SECS)
+            self.wake.clear()
+            if(not self.stopped):
+                force, self.force = self.force, False
+                self._upload(force)
+
+    def _upload(self, force):
+        self._send_retries(force)
+        with self.lock:
+            if(not (force or len(self.reports) >= MAX_REPORTS or (time.time() - self.last_report_time) > REPORT_SECS)):
+                return
+            reports, self.reports = self.reports, {}
+        if (time.time() - self.last_descriptors_time) > 3600:
+            self.descriptors_sent_count = 0
+            self.last_descriptors_time = time.time()
+        if(reports):
+            self._send(list(reports.values()), includeDescriptors = (self.descriptors_sent_count < 4))
+            self.descriptors_sent_count +=1
+        self.last_report_time = time.time()
+
+    def _resolve(self):
+        # the server address is looked up once and then only every DNS_TTL_SECS
+        if(self.resolved is None or time.time() - self.resolved_time > DNS_TTL_SECS):
+            try:
+                self.resolved = (socket.gethostbyname(self.addr[0]), self.addr[1])
+                self.resolved_time = time.time()
+            except OSError as e:
+                print(f"[PSKR_upload] Can't resolve {self.addr[0]}: {e}")
+        return self.resolved
+
+    def _pack(self, reports, includeDescriptors = False):
+        # one packet per run of sender records that fits in MAX_PAYLOAD bytes
+        header = self.RxInfoRecDescriptor_CallLocSoft + self.SenderInfoRecDescriptor_SenderFreqSNRiMDModeSourceTime if includeDescriptors else b""
+        header += self.rx_block
+        room = MAX_PAYLOAD - 16 - len(header) - 4 - 3
+        batches, senders, n = [], bytearray(), 0
+        for dxcall, freq_hz, snr, mode, source, tt in reports:
             sender = self._enc_str(dxcall) + struct.pack("!I", int(freq_hz)) + struct.pack("b", int(snr)) + struct.pack("b", 0) + self._enc_str(mode) + struct.pack("B", source) + struct.pack("!I", tt)
+            if(n and len(senders) + len(sender) > room):
+                batches.append((senders, n))
+                senders, n = bytearray(), 0
             senders += sender
-        packet = bytearray(header + self.rx_block + self._block(b"\x99\x93", senders))
-        struct.pack_into("!H", packet, 2, len(packet))
-        self.seq += len(self.reports)
-        self.sock.sendto(packet, self.addr)
-        txt = f"[pskr_upload] Sent packet with {len(self.reports)} reports"
+            n += 1
+        if(n):
+            batches.append((senders, n))
+        packets = []
+        for senders, n in batches:
+            ipfx_header = struct.pack("!H", 10) + b"\x00\x00" + struct.pack("!I", int(time.time())) + struct.pack("!I", self.seq) + struct.pack("!I", self.session_id)
+            packet = bytearray(ipfx_header + header + self._block(b"\x99\x93", senders))
+            struct.pack_into("!H", packet, 2, len(packet))
+            packets.append((packet, n))
+            self.seq += n
+        return packets
+
+    def _send(self, reports, includeDescriptors = False):
+        if not reports:
+            return
+        if includeDescriptors:
+            print(f"[PSKR_upload] Packing descriptors")
+        packets = self._pack(reports, includeDescriptors)
+        n_failed = 0
+        for packet, n in packets:
+            if(not self._sendto(packet)):
+                self.retries.append([packet, 1, time.time() + RETRY['BACKOFF_SECS']])
+                n_failed += 1
+        txt = f"[PSKR_upload] Sent {len(reports)} reports in {len(packets)} packets" + (f", {n_failed} queued to retry" if n_failed else "")
         print(txt)
-        self.console_print(txt)
-        self.reports = {}
-        self.last_report_time = time.time()
+        if(self.console_print):
+            self.console_print(txt)
+
+    def _send_retries(self, force = False):
+        for _ in range(len(self.retries)):
+            packet, attempts, next_time = self.retries.popleft()
+            if(time.time() < next_time and not force):
+                self.retries.append([packet, attempts, next_time])
+            elif(not self._sendto(packet)):
+                if(attempts < RETRY['ATTEMPTS']):
+                    self.retries.append([packet, attempts + 1, time.time() + RETRY['BACKOFF_SECS'] * 2**attempts])
+                else:
+                    print(f"[PSKR_upload] Dropped a packet after {attempts + 1} attempts")
+
+    def _sendto(self, packet):
+        addr = self._resolve()
+        if(addr is None):
+            return False
+        try:
+            self.sock.sendto(packet, addr)
+            return True
+        except OSError as e:
+            print(f"[PSKR_upload] Send failed: {e}")
+            self.resolved = None
+            return False
 
 
 #pskr = PSKR_upload('G1OJS', 'IO90ju', software = 'PyFT8', console_print = None)
 #pskr.add_report('G1OJS', 14074000, -5, 'FT8', 2, int(time.time()))
-#pskr._send(includeDescriptors = True)
+#pskr.flush()
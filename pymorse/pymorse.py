@@ -1,48 +1,90 @@
 import numpy as np
 import time
-import matplotlib.pyplot as plt
-from matplotlib.animation import FuncAnimation
 import threading
-import pyaudio
 import argparse
-#from pymorse.pskr_upload import PSKR_upload
+import wave
+import json
+import sys
+import atexit
+import signal
+import functools
+import re
+import os
+import queue
+from pymorse.pskr_upload import PSKR_upload
+from pymorse.morse_table import MORSE, MORSE_TABLE, MORSE_NEAREST
 
 WF_RECENT_QUALITY_SQUELCH_LENGTH = 50  
 RECENT_QUALITY_SQUELCH_THRESH = 6
 WF_MODE = 'wf_wipe'
 SHOW_KEYLINES = True
-SPEED = {'MAX':45, 'MIN':18, 'ALPHA':0.1}
+SPEED = {'MAX':45, 'MIN':12, 'START':16, 'N_SCALES':48, 'COARSE':4, 'RUNS':24, 'MIN_RUNS':8, 'MAX_ERR':0.4, 'UPDATE_HOPS':8}
 TICKER_FIELD_LENGTHS = {'MORSE':30, 'TEXT':30}
 TIMESPEC = {'DOT_SHORT':0.65, 'DOT_LONG':2, 'CHARSEP_SHORT':2, 'CHARSEP_WORDSEP':6}
 DISPLAY_DUR = 3
 HOP_MS = 12
+PFB = {'TAPS':4, 'BW_BINS':2}
+WF_MAX_BACKLOG = 8
+STALL_SECS = 0.5
+SPOTTER = {'IDLE':0, 'CQ':1, 'DE':2, 'WORDS_TO_CALL':3}
+CHANNEL_SWAP = {'INTERVAL_SECS':0.25, 'HYSTERESIS_DB':2, 'MAX_PER_UPDATE':4}
+CORREL = {'WPM':[12, 40], 'N_SPEEDS':20, 'SPEED_TOL':1.3, 'MAX_ELEMENTS':6, 'LEAD_UNITS':2, 'TRAIL_UNITS':3, 'THRESH':0.6, 'ELEMENT_BONUS':0.02, 'MIN_CONTRAST_DB':6, 'HOLD_UNITS':20, 'CHARSEP_UNITS':2, 'WORDSEP_UNITS':5, 'WORD_TIMEOUT_UNITS':25, 'GAP_MAX_KEYDOWN':0.2}
 DISPLAY_DECIMATE = 2
-MORSE = {'.-': 'A', '-...': 'B', '-.-.': 'C', '-..': 'D', '.': 'E', '..-.': 'F', '--.': 'G', '....': 'H', '..': 'I', '.---': 'J', 
-'-.-': 'K', '.-..': 'L', '--': 'M', '-.': 'N', '---': 'O', '.--.': 'P', '--.-': 'Q', '.-.': 'R', '...': 'S', '-': 'T', 
-'..-': 'U', '...-': 'V', '.--': 'W', '-..-': 'X', '-.--': 'Y', '--..': 'Z', '-----': '0', '.----': '1', '..---': '2', '...--': '3', 
-'....-': '4', '.....': '5', '-....': '6', '--...': '7', '---..': '8', '----.': '9', '-..-.': '/', '..--': 'Ü', '-.-.-': '_AR_', '.-.-.': '_AR_', 
-'..--..': '?', '-...-': '_BK_', '...-.-': '_SK_', '..-.-.': '_UR_', '-.--.': '_KN_', '-.-.--.-': '_CQ_', '...-.': 'P', '.-..-': 'J', '.--..': 'J', '.-...': 'P', 
-'..-.-': 'Q', '-.-..': 'Y', '..-..': 'Ü', '..----': '0', '-..---': '0', '--..--': '0', '---..-': '0', '----..': '0', '...---': '1', '.-..--': '1', 
-'.--..-': '1', '.---..': '1', '....--': '2', '..-..-': '2', '.....-': '_BK_', '...-..': '3', '......': '6', '..-...': '7', '-.....': '_BK_', '-..-..': '8', 
-'--....': '8', '..---.': '9', '-..--.': '9', '--..-.': '9', '---...': '9', '....-.': '_AR_', '-....-': '_AR_', '-.-...': '_KN_', '.-....': '_AR_', '....-..': '?', 
-'..-....': '_UR_', '......-': '_SK_', '...-...': '_SK_', '.....-.': '_UR_', '...--.': '_KN_', '-...-.': '_KN_', '...-.--.-': '_CQ_', '-....--.-': '_CQ_', '-.-...-.-': '_CQ_', '-.-.-...-': '_CQ_'}
-
-def debug(text):
-    with open('PyMorse.txt', 'a') as f:
-        f.write(f"{txt}\n")
-    
+DECODE_LOG = {'FLUSH_SECS':1, 'MAX_BYTES':10_000_000, 'ROTATE_SECS':86400}
+RECORD = {'MAX_SECS':3600}
+
+class Ring_buffer:
+
+    def __init__(self, size, dtype = np.float32):
+        self.size = size
+        self.buff = np.zeros(2 * size, dtype = dtype)
+        self.n_written = 0
+        self.lock = threading.Lock()
+        self.written = threading.Condition(self.lock)
+
+    def write(self, samples):
+        n, i = len(samples), self.n_written % self.size
+        self.buff[i:i+n] = samples
+        if(i + n <= self.size):
+            self.buff[i+self.size:i+self.size+n] = samples
+        else:
+            k = self.size - i
+            self.buff[i+self.size:] = samples[:k]
+            self.buff[:n-k] = samples[k:]
+        with self.lock:
+            self.n_written += n
+            self.written.notify_all()
+
+    def wait_for(self, n_written, timeout = None):
+        with self.written:
+            return self.written.wait_for(lambda: self.n_written >= n_written, timeout)
+
+    def window(self, n, end = None):
+        with self.lock:
+            end = self.n_written if end is None else end
+        start = end - n
+        i = start % self.size
+        return self.buff[i:i+n], start
+
 class Audio_in:
+    # one PyAudio instance and device list shared by every input in the process
+    pya = None
+    device_names = None
     
-    def __init__(self, input_device_keywords, sample_rate, bufflen, frames_perbuff):
-        self.audiobuff = np.zeros(bufflen, dtype=np.float32)
-        self.pya = pyaudio.PyAudio()
+    def __init__(self, input_device_keywords, sample_rate, bufflen, frames_perbuff, iq = False):
+        import pyaudio
+        self.iq = iq
+        self.ring = Ring_buffer(bufflen, np.complex64 if iq else np.float32)
+        self.pa_format, self.pa_continue = pyaudio.paInt16, pyaudio.paContinue
+        if(Audio_in.pya is None):
+            Audio_in.pya = pyaudio.PyAudio()
+            Audio_in.device_names = [self.pya.get_device_info_by_index(i)['name'] for i in range(self.pya.get_device_count())]
         self.input_device_idx = self.find_device(input_device_keywords)
         self.start_audio_in(sample_rate, frames_perbuff)
         
     def find_device(self, device_str_contains):
         print(f"[Audio] Looking for audio device matching {device_str_contains}")
-        for dev_idx in range(self.pya.get_device_count()):
-            name = self.pya.get_device_info_by_index(dev_idx)['name']
+        for dev_idx, name in enumerate(self.device_names):
             match = True
             for pattern in device_str_contains:
                 if (not pattern in name): match = False
@@ -53,154 +95,776 @@ class Audio_in:
     
     def start_audio_in(self, sample_rate, frames_perbuff):
         stream = self.pya.open(
-            format = pyaudio.paInt16, channels=1, rate = sample_rate,
+            format = self.pa_format, channels = 2 if self.iq else 1, rate = sample_rate,
             input = True, input_device_index = self.input_device_idx,
             frames_per_buffer = frames_perbuff, stream_callback=self._pya_callback,)
         stream.start_stream()
 
     def _pya_callback(self, in_data, frame_count, time_info, status_flags):
-        samples = np.frombuffer(in_data, dtype=np.int16).astype(np.float32)
-        ns = len(samples)
-        self.audiobuff[:-ns] = self.audiobuff[ns:]
-        self.audiobuff[-ns:] = samples
-        return (None, pyaudio.paContinue)
+        samples = np.frombuffer(in_data, dtype=np.int16)
+        if(self.iq):
+            samples = samples[0::2] + 1j * samples[1::2]
+        self.ring.write(samples)
+        return (None, self.pa_continue)
+
+class File_in:
+    # WAV or raw file (or '-' for stdin), resampled to sample_rate. With iq = 'int16' or 'float32' the
+    # samples are complex baseband: interleaved I/Q for raw input, left/right for a stereo WAV
+    def __init__(self, filename, sample_rate, bufflen, block, file_rate = None, chunk_secs = 10, fir_taps = 63, iq = None):
+        self.dtype = np.complex64 if iq else np.float32
+        self.ring = Ring_buffer(bufflen, self.dtype)
+        self.block = block
+        self.iq = iq
+        self.n_chans = 2 if iq else 1
+        self.sample_type = np.float32 if iq == 'float32' else np.int16
+        if filename.lower().endswith('.wav'):
+            self.wav = wave.open(filename, 'rb')
+            if self.wav.getsampwidth() != 2:
+                raise ValueError(f"[File] {filename} is not a 16-bit WAV file")
+            file_rate, self.n_chans = self.wav.getframerate(), self.wav.getnchannels()
+            if(iq and self.n_chans != 2):
+                raise ValueError(f"[File] {filename} is not a stereo (I/Q) WAV file")
+            self.sample_type = np.int16
+            self.read_frames = self.wav.readframes
+        else:
+            self.raw = sys.stdin.buffer if filename == '-' else open(filename, 'rb')
+            file_rate = file_rate or sample_rate
+            chunk_secs = 1 if filename == '-' else chunk_secs
+            frame_bytes = self.n_chans * np.dtype(self.sample_type).itemsize
+            self.read_frames = lambda n: self.raw.read(frame_bytes * n)
+        print(f"[File] Reading {filename}{' as ' + iq + ' IQ' if iq else ''} at {file_rate} Hz, resampling to {sample_rate} Hz")
+        self.chunk_frames = int(chunk_secs * file_rate)
+        self.step = file_rate / sample_rate
+        self.pending = np.zeros(0, dtype = self.dtype)
+        self.src, self.src_pos = np.zeros(0, dtype = self.dtype), 0.0
+        self.fir = None
+        if self.step > 1:
+            # anti-alias filter at the output Nyquist, applied polyphase at 1/decim of the input rate
+            # (leaving at least 4x oversampling for the interpolation that follows)
+            self.decim = max(1, int(self.step / 4))
+            fir_taps = max(fir_taps, 6 * int(np.ceil(self.step)) + 1)
+            n = np.arange(fir_taps) - (fir_taps - 1) / 2
+            fir = np.sinc(n / self.step) * np.hamming(fir_taps) / self.step
+            fir = np.concatenate((fir, np.zeros(-fir_taps % self.decim)))
+            self.fir = [fir[p::self.decim].astype(np.float32) for p in range(self.decim)]
+            self.fir_buf = np.zeros(len(fir) - 1, dtype = self.dtype)
+            self.step /= self.decim
+
+    def _decimate(self, x):
+        D, taps = self.decim, len(self.fir[0])
+        x = np.concatenate((self.fir_buf, x))
+        n_out = max(0, (len(x) - taps * D) // D + 1)
+        y = np.zeros(n_out, dtype = self.dtype)
+        if(n_out):
+            for p, fir in enumerate(self.fir):
+                y += np.correlate(x[p:p + (n_out + taps - 1) * D:D], fir, mode = 'valid')
+        self.fir_buf = x[n_out * D:]
+        return y
+
+    def _resample(self, x):
+        if self.step == 1 and self.fir is None:
+            return x
+        if self.fir is not None:
+            x = self._decimate(x)
+        self.src = np.concatenate((self.src, x))
+        n = int((len(self.src) - 1 - self.src_pos) / self.step) + 1 if len(self.src) > self.src_pos + 1 else 0
+        y = np.interp(self.src_pos + self.step * np.arange(n), np.arange(len(self.src)), self.src)
+        self.src_pos += n * self.step
+        consumed = int(self.src_pos)
+        self.src, self.src_pos = self.src[consumed:], self.src_pos - consumed
+        return y.astype(self.dtype)
+
+    def advance(self):
+        while len(self.pending) < self.block:
+            data = self.read_frames(self.chunk_frames)
+            if not data:
+                if not len(self.pending):
+                    return False
+                break
+            x = np.frombuffer(data, dtype = self.sample_type)
+            x = x[:len(x) // self.n_chans * self.n_chans].reshape(-1, self.n_chans)
+            samples = (x[:, 0] + 1j * x[:, 1]) if self.iq else x[:, 0]
+            self.pending = np.concatenate((self.pending, self._resample(samples.astype(self.dtype))))
+        self.ring.write(self.pending[:self.block])
+        self.pending = self.pending[self.block:]
+        return True
 
 class Spectrum:
-    def __init__(self, input_device_keywords, df,  freq_range, fft_len = 256):
-        fft_out_len = fft_len //2 + 1
-        fmax = fft_out_len * df
-        freq_range = np.clip(freq_range, None, fmax)
+    # with iq set, the input is complex baseband and freq_range is relative to the centre frequency,
+    # covering both sides of it
+    def __init__(self, input_device_keywords, df,  freq_range, fft_len = 256, audio_file = None, file_rate = None, ring_secs = 2, engine = 'fft', iq = None):
+        fft_len = max(fft_len, int(2**np.ceil(np.log2(2 * np.max(np.abs(freq_range)) / df))))
+        if(iq):
+            fmax = fft_len // 2 * df
+            freq_range = np.clip(freq_range, -fmax, fmax)
+        else:
+            fft_out_len = fft_len //2 + 1
+            fmax = fft_out_len * df
+            freq_range = np.clip(freq_range, None, fmax)
+        self.fft = np.fft.fft if iq else np.fft.rfft
         sample_rate = int(fft_len * df)
         self.fBins = range(int(freq_range[0]/df), int(freq_range[1]/df) - 1)
         freq_range = [self.fBins[0] * df, self.fBins[-1] * df]
         self.nf = len(self.fBins)
-        self.params = {'nf':self.nf, 'df':df, 'sr':sample_rate, 'fmax':fmax, 'fRng':freq_range}
+        self.freqs = np.array(self.fBins) * df
+        self.inputs = np.zeros(self.nf, dtype = int)
+        self.hop_samples = int(sample_rate * HOP_MS / 1000)
+        # the true hop, a little under HOP_MS as it is a whole number of samples
+        self.params = {'nf':self.nf, 'df':df, 'sr':sample_rate, 'fmax':fmax, 'fRng':freq_range, 'engine':engine, 'iq':iq, 'hop_secs':self.hop_samples / sample_rate}
         print(self.params)
-        self.window = np.hanning(fft_len)
-        self.audio = Audio_in(input_device_keywords, sample_rate, fft_len, int(fft_len/8))
+        self.window = np.hanning(fft_len + 1)[:-1]
+        self.fft_len = fft_len
+        self.next_hop_end = fft_len
+        self.skipped_hops = 0
+        self.finished = False
+        self.t = np.zeros(0)
+        self.calc_pwr = {'fft':self._pwr_fft, 'sdft':self._pwr_sdft, 'pfb':self._pwr_pfb}[engine]
+        self.frame_len = fft_len
+        if(engine == 'sdft'):
+            ks = np.arange(self.fBins[0] - 1, self.fBins[-1] + 2)
+            self.sdft_twiddle = np.exp(-2j * np.pi * np.outer(np.arange(max(fft_len, self.hop_samples)) % fft_len, ks) / fft_len)
+            self.sdft_block = self.sdft_twiddle[:self.hop_samples]
+            if(not iq):
+                # real input: one real product with interleaved cos and -sin columns, viewed as complex
+                self.sdft_block = np.ascontiguousarray(self.sdft_block).view(float)
+            self.sdft_q = fft_len // self.hop_samples
+            self.sdft_sums = self.sdft_tails = np.zeros((0, len(ks)), dtype = complex)
+            self.sdft_pos = None
+            self.frame_len = fft_len + self.hop_samples
+        if(engine == 'pfb'):
+            self.frame_len = PFB['TAPS'] * fft_len
+            n = np.arange(self.frame_len) - (self.frame_len - 1) / 2
+            self.pfb_coeffs = np.sinc(PFB['BW_BINS'] * n / fft_len) * np.hamming(self.frame_len)
+        # at least a frame plus a second of hops in each half of the ring, for long pfb frames at small df
+        ring_len = max(int(ring_secs * sample_rate), 2 * (self.frame_len + self.hop_samples * int(1000 / HOP_MS)))
+        self.max_hops = (ring_len // 2 - self.frame_len) // self.hop_samples
+        if audio_file:
+            self.audio = File_in(audio_file, sample_rate, ring_len, self.hop_samples * int(1000 / HOP_MS), file_rate, iq = iq)
+        else:
+            self.audio = Audio_in(input_device_keywords, sample_rate, ring_len, int(fft_len/8), iq = bool(iq))
+
+    def wait_for_hop(self, timeout = None):
+        return self.audio.ring.wait_for(self.next_hop_end, timeout)
+
+    def hops_available(self):
+        with self.audio.ring.lock:
+            n_written = self.audio.ring.n_written
+        return max(0, (n_written - self.next_hop_end) // self.hop_samples + 1)
+
+    def calc_spectrum(self, n_max = None):
+        hop = self.hop_samples
+        n_hops = self.hops_available()
+        if(n_hops == 0):
+            self.pwr, self.t = np.zeros((0, self.nf)), np.zeros(0)
+            return 0
+        if(n_hops > self.max_hops):
+            self.skipped_hops += n_hops - self.max_hops
+            self.next_hop_end += (n_hops - self.max_hops) * hop
+            n_hops = self.max_hops
+        if(n_max is not None):
+            n_hops = min(n_hops, n_max)
+        last_hop_end = self.next_hop_end + (n_hops - 1) * hop
+        self.pwr = self.calc_pwr(n_hops, last_hop_end)
+        self.t = (self.next_hop_end + hop * np.arange(n_hops)) / self.params['sr']
+        self.next_hop_end = last_hop_end + hop
+        return n_hops
+
+    def _pwr_fft(self, n_hops, last_hop_end):
+        hop = self.hop_samples
+        audio, start = self.audio.ring.window(self.fft_len + (n_hops - 1) * hop, last_hop_end)
+        frames = np.lib.stride_tricks.sliding_window_view(audio, self.fft_len)[::hop]
+        z = self.fft(frames * self.window, axis = 1)[:, self.fBins]
+        return z.real*z.real + z.imag*z.imag
+
+    def _pwr_pfb(self, n_hops, last_hop_end):
+        # polyphase filterbank: weight TAPS consecutive blocks of fft_len samples with the prototype
+        # lowpass, sum them and transform, giving fft_len channels decimated to the hop rate
+        hop = self.hop_samples
+        audio, start = self.audio.ring.window(self.frame_len + (n_hops - 1) * hop, last_hop_end)
+        frames = np.lib.stride_tricks.sliding_window_view(audio, self.frame_len)[::hop]
+        presum = (frames * self.pfb_coeffs).reshape(n_hops, PFB['TAPS'], self.fft_len).sum(axis = 1)
+        z = self.fft(presum, axis = 1)[:, self.fBins]
+        return z.real*z.real + z.imag*z.imag
+
+    def _pwr_sdft(self, n_hops, last_hop_end):
+        # sliding DFT of the needed bins (plus one either side for the Hann window), a block of hop
+        # samples at a time: each block's sum of samples times twiddles is one small matrix product,
+        # and each hop is the sum of the last q = fft_len // hop blocks plus the last fft_len % hop
+        # samples of the block before. The q block sums before this call carry over from the last
+        N, hop, q = self.fft_len, self.hop_samples, self.sdft_q
+        r = N - q * hop
+        n_blocks = n_hops if self.sdft_pos == last_hop_end - n_hops * hop else n_hops + q
+        audio, start = self.audio.ring.window(n_blocks * hop, last_hop_end)
+        blocks = audio.reshape(n_blocks, hop)
+        phase = self.sdft_twiddle[(start + hop * np.arange(n_blocks)) % N]
+        sums = (blocks @ self.sdft_block).view(complex) * phase
+        tails = (blocks[:, hop - r:] @ self.sdft_block[hop - r:]).view(complex) * phase
+        if(n_blocks == n_hops):
+            sums, tails = np.concatenate((self.sdft_sums, sums)), np.concatenate((self.sdft_tails, tails))
+        self.sdft_sums, self.sdft_tails = sums[len(sums) - q:], tails[len(tails) - q:]
+        self.sdft_pos = last_hop_end
+        csum = np.concatenate((np.zeros((1, sums.shape[1]), dtype = complex), np.cumsum(sums, axis = 0)))
+        z = csum[q + 1:] - csum[1:n_hops + 1] + tails[:n_hops]
+        z *= self.sdft_twiddle[(last_hop_end - N - hop * np.arange(n_hops - 1, -1, -1)) % N].conj()
+        z = 0.5 * z[:, 1:-1] - 0.25 * (z[:, :-2] + z[:, 2:])
+        return z.real*z.real + z.imag*z.imag
+
+class Multi_spectrum:
+    # several inputs, each with its own Spectrum, presented as one spectrum with their bins stacked.
+    # Each call processes the hops that every live input has ready; an input whose clock runs fast
+    # builds up a backlog that is trimmed as skipped hops when it outgrows that input's ring. An
+    # input with no hops for STALL_SECS while the others have them is left out, its bins reading a
+    # power of 1 (below any real noise floor, but finite in dB), until it delivers again and
+    # rejoins at its newest hop
+    def __init__(self, spectra):
+        self.spectra = spectra
+        self.nf = sum(s.nf for s in spectra)
+        self.freqs = np.concatenate([s.freqs for s in spectra])
+        self.inputs = np.concatenate([np.full(s.nf, i) for i, s in enumerate(spectra)])
+        self.params = dict(spectra[0].params, nf = self.nf, n_inputs = len(spectra))
+        self.pwr, self.t = np.zeros((0, self.nf)), np.zeros(0)
+        self.live = [True] * len(spectra)
+        self.last_hop_time = [time.time()] * len(spectra)
+        self.rejoin_skipped = 0
+        self.finished = False
+
+    @property
+    def next_hop_end(self):
+        return self.spectra[0].next_hop_end
+
+    @property
+    def skipped_hops(self):
+        return sum(s.skipped_hops for s in self.spectra) + self.rejoin_skipped
+
+    def wait_for_hop(self, timeout = None):
+        # waits on the live inputs only, and never long enough for the others to overrun their rings
+        deadline = time.time() + min(STALL_SECS / 2, timeout if timeout is not None else STALL_SECS)
+        for s, live in zip(self.spectra, self.live):
+            if(live and not s.wait_for_hop(max(deadline - time.time(), 0))):
+                return any(s.hops_available() for s in self.spectra)
+        return True
+
+    def update_live(self, avail):
+        now = time.time()
+        for i, s in enumerate(self.spectra):
+            if(avail[i]):
+                self.last_hop_time[i] = now
+                if(not self.live[i]):
+                    skip = avail[i] - 1
+                    s.next_hop_end += skip * s.hop_samples
+                    self.rejoin_skipped += skip
+                    avail[i] = 1
+                    self.live[i] = True
+                    print(f"[Multi_spectrum] Input {i} is delivering again, rejoining")
+            elif(self.live[i] and any(avail) and now - self.last_hop_time[i] > STALL_SECS):
+                self.live[i] = False
+                print(f"[Multi_spectrum] Input {i} has stalled, decoding the other inputs without it")
 
     def calc_spectrum(self):
-        z = np.fft.rfft(self.audio.audiobuff * self.window)[self.fBins]
-        self.pwr = z.real*z.real + z.imag*z.imag
+        avail = [s.hops_available() for s in self.spectra]
+        self.update_live(avail)
+        live = [s for s, ok in zip(self.spectra, self.live) if ok]
+        n_hops = min(min(a for a, ok in zip(avail, self.live) if ok), min(s.max_hops for s in live)) if live else 0
+        if(n_hops == 0):
+            self.pwr, self.t = np.zeros((0, self.nf)), np.zeros(0)
+            return 0
+        for s in live:
+            s.calc_spectrum(n_hops)
+        self.pwr = np.concatenate([s.pwr if ok else np.ones((n_hops, s.nf)) for s, ok in zip(self.spectra, self.live)], axis = 1)
+        self.t = live[0].t
+        return n_hops
+
+class Spectrum_recorder:
+    # each hop's power row, hop index and time, copied into a .npy file that is preallocated for
+    # max_secs and memory mapped, so recording never waits on the disk. The first row of each
+    # batch of hops the hot loop took is flagged, so a replay can hand them over the same way.
+    # Rows not yet written are zero (a written row never has t = 0), so a recording cut short
+    # still replays; the spectrum parameters go in a .json file alongside
+    def __init__(self, spectrum, filename, max_secs = RECORD['MAX_SECS']):
+        self.spectrum, self.filename = spectrum, filename
+        dtype = np.dtype([('hop', np.int64), ('t', np.float64), ('first', bool), ('pwr', np.float32, (spectrum.nf,))])
+        self.rows = np.lib.format.open_memmap(filename, mode = 'w+', dtype = dtype, shape = (int(max_secs * 1000 / HOP_MS),))
+        self.n_hops = 0
+        self.write_meta()
+        print(f"[Spectrum_recorder] Recording up to {max_secs}s of spectra to {filename}")
+
+    def write_meta(self):
+        s = self.spectrum
+        meta = {'params':s.params, 'freqs':s.freqs.tolist(), 'inputs':s.inputs.tolist(), 'hop_ms':HOP_MS, 'n_hops':self.n_hops}
+        with open(self.filename + '.json', 'w') as f:
+            json.dump(meta, f, default = lambda v: v.item())
+
+    def write(self, hop, t, pwr):
+        # hop is the index of the first of these rows, counting skipped hops
+        n = min(len(t), len(self.rows) - self.n_hops)
+        if(n < len(t) and self.n_hops < len(self.rows)):
+            print(f"[Spectrum_recorder] {self.filename} is full, recording stopped")
+        i, j = self.n_hops, self.n_hops + n
+        self.rows['hop'][i:j] = hop + np.arange(n)
+        self.rows['t'][i:j] = t[:n]
+        self.rows['first'][i:j] = np.arange(n) == 0
+        self.rows['pwr'][i:j] = pwr[:n]
+        self.n_hops = j
+
+    def close(self):
+        self.rows.flush()
+        self.write_meta()
+        print(f"[Spectrum_recorder] Recorded {self.n_hops} hops to {self.filename}")
+
+class Spectrum_replay:
+    # a recording made by Spectrum_recorder, presented as a Spectrum: calc_spectrum hands out the
+    # rows that are due as slices of the memory map, with no copy and no transform. Rows are due
+    # at speed times their recorded rate, or with speed 0 as advance() releases them, one recorded
+    # batch at a time and as fast as the decoders take them
+    def __init__(self, filename, speed = 1):
+        with open(filename + '.json') as f:
+            meta = json.load(f)
+        rows = np.load(filename, mmap_mode = 'r')
+        n = meta['n_hops'] or int(np.count_nonzero(rows['t']))
+        self.hops, self.t_rows, self.pwr_rows = rows['hop'][:n], rows['t'][:n], rows['pwr'][:n]
+        self.batch_ends = np.append(np.flatnonzero(rows['first'][1:n]) + 1, n)
+        self.params, self.nf = meta['params'], meta['params']['nf']
+        self.params.setdefault('hop_secs', meta['hop_ms'] / 1000)
+        self.freqs, self.inputs = np.array(meta['freqs']), np.array(meta['inputs'])
+        self.speed = speed
+        self.pos, self.released, self.start = 0, 0, None
+        self.pwr, self.t = self.pwr_rows[:0], self.t_rows[:0]
+        print(f"[Spectrum_replay] Replaying {n} hops ({self.t_rows[-1] - self.t_rows[0] if n else 0:.1f}s) from {filename}" + (f" at {speed}x" if speed else ""))
+
+    @property
+    def next_hop_end(self):
+        return int(self.t_rows[self.pos - 1] * self.params['sr']) if self.pos else 0
+
+    @property
+    def skipped_hops(self):
+        return int(self.hops[self.pos - 1] - self.hops[0] + 1 - self.pos) if self.pos else 0
+
+    @property
+    def finished(self):
+        return self.pos >= len(self.t_rows)
+
+    def advance(self):
+        self.released = int(self.batch_ends[np.searchsorted(self.batch_ends, self.pos, 'right')]) if self.pos < len(self.t_rows) else self.pos
+        return self.pos < len(self.t_rows)
+
+    def due(self):
+        if(not self.speed):
+            return self.released
+        if(self.start is None):
+            self.start = time.perf_counter() - self.t_rows[0] / self.speed
+        return int(np.searchsorted(self.t_rows, (time.perf_counter() - self.start) * self.speed, 'right'))
+
+    def wait_for_hop(self, timeout = None):
+        if(self.pos < len(self.t_rows) and self.speed and self.start is not None):
+            wait = self.start + self.t_rows[self.pos] / self.speed - time.perf_counter()
+            time.sleep(max(min(wait, timeout if timeout is not None else wait), 0))
+        elif(self.pos >= len(self.t_rows)):
+            time.sleep(timeout or 0)
+        return self.due() > self.pos
+
+    def calc_spectrum(self, n_max = None):
+        end = self.due()
+        if(n_max is not None):
+            end = min(end, self.pos + n_max)
+        self.pwr, self.t = self.pwr_rows[self.pos:end], self.t_rows[self.pos:end]
+        n_hops, self.pos = max(end - self.pos, 0), max(end, self.pos)
+        if(n_hops and self.pos == len(self.t_rows)):
+            print(f"[Spectrum_replay] End of recording")
+        return n_hops
+
+def open_spectrum(input_device_keywords, df, freq_range, engine = 'fft', iq = None, replay = None, replay_speed = 1):
+    # input_device_keywords is one list of keywords, or a list of them for several inputs
+    if(replay):
+        return Spectrum_replay(replay, replay_speed)
+    if(input_device_keywords and isinstance(input_device_keywords[0], (list, tuple))):
+        if(len(input_device_keywords) > 1):
+            return Multi_spectrum([Spectrum(kw, df, freq_range, engine = engine, iq = iq) for kw in input_device_keywords])
+        input_device_keywords = input_device_keywords[0]
+    return Spectrum(input_device_keywords, df, freq_range, engine = engine, iq = iq)
+
+class Speed_estimator:
+    # a ring of recent mark and space lengths for every bin, scored against a bank of unit lengths
+    # from SPEED['MIN'] to SPEED['MAX'] for all bins at once: marks fit 1 or 3 units and spaces
+    # 1, 3 or 7, so only the true unit fits both the dots and spaces and the dashes. Units and runs
+    # are held as steps along the unit grid, up from the shortest unit, so the error of a run
+    # against a unit is a lookup by their difference in a table with a row each for spaces, marks
+    # and empty ring slots. Only bins with new runs are scored, at every COARSE'th unit and then at
+    # the units around the best of those
+
+    def __init__(self, nf):
+        n = SPEED['N_SCALES']
+        self.step = np.log(SPEED['MAX'] / SPEED['MIN']) / (n - 1)
+        k_min, k_max = self.grid_steps(0.5 * 1.2 / SPEED['MAX']), self.grid_steps(7 * 1.2 / SPEED['MIN'])
+        self.k_range, self.offset = (k_min, k_max), n - 1 - k_min
+        r = (np.arange(k_max - k_min + n) - self.offset) * self.step
+        err_mark = np.minimum(np.abs(r), np.abs(r - np.log(3)))
+        err_space = np.minimum(err_mark, np.abs(r - np.log(7)))
+        self.errors = np.minimum(np.concatenate((err_space, err_mark, 0 * r)), SPEED['MAX_ERR'])
+        self.row_len = len(r)
+        self.runs = np.full((nf, SPEED['RUNS']), 2 * self.row_len + self.offset + k_max)
+        self.n_runs = np.zeros(nf, dtype = int)
+        self.changed = np.zeros(nf, dtype = bool)
+        self.coarse = np.arange(0, n, SPEED['COARSE'])
+        self.fine = np.arange(1 - SPEED['COARSE'], SPEED['COARSE'])
+
+    def grid_steps(self, dur):
+        return np.rint(np.log(dur * SPEED['MAX'] / 1.2) / self.step).astype(int)
+
+    def add(self, fb, dur, is_mark):
+        # runs with fb in ascending order and each bin's runs in time order
+        if(len(fb) == 0):
+            return
+        keep = (0.5 * 1.2 / SPEED['MAX'] < dur) & (dur < 7 * 1.2 / SPEED['MIN'])
+        fb, dur, is_mark = fb[keep], dur[keep], is_mark[keep]
+        i = (self.n_runs[fb] + np.arange(len(fb)) - np.searchsorted(fb, fb)) % SPEED['RUNS']
+        k = np.clip(self.grid_steps(dur), *self.k_range)
+        self.runs[fb, i] = is_mark * self.row_len + self.offset + k
+        np.add.at(self.n_runs, fb, 1)
+        self.changed[fb] = True
+
+    def estimate(self, bins):
+        # wpm for each of bins, NaN for those with fewer than MIN_RUNS runs or none since the last estimate
+        wpm = np.full(len(bins), np.nan)
+        bins = np.asarray(bins)
+        due = self.changed[bins] & (self.n_runs[bins] >= SPEED['MIN_RUNS'])
+        if(not np.any(due)):
+            return wpm
+        self.changed[bins[due]] = False
+        runs = self.runs[bins[due], :, None]
+        u = self.coarse[np.argmin(self.errors[runs - self.coarse].sum(axis = 1), axis = 1)]
+        u = np.clip(u[:, None] + self.fine, 0, SPEED['N_SCALES'] - 1)
+        u = u[np.arange(len(u)), np.argmin(self.errors[runs - u[:, None, :]].sum(axis = 1), axis = 1)]
+        wpm[due] = SPEED['MAX'] * np.exp(-u * self.step)
+        return wpm
 
 class TimingDecoder:
+    # the elements of the character being received are held as a packed code: dashes as 1 bits
+    # below a leading 1, which is also the index into MORSE_TABLE
 
-    def __init__(self, unknown_chars):
+    def __init__(self, unknown_chars, on_event = None):
         self.unknown_chars = unknown_chars
+        self.table = MORSE_NEAREST if unknown_chars == 'nearest' else MORSE_TABLE
+        self.on_event = on_event
         self.keypos = 'up'
-        self.key_last_moved = time.time()
-        self.element_buffer = ''
-        self.wpm = 16
+        self.element_code = 1
         self.morse = ''
         self.text = ''
-        self.max_charlen = np.max([len(k) for k in MORSE.keys()])
-        self.update_speed(1.2/16)
-
-    def update_speed(self, mark_dur):
-        if('TTT' in self.text):
-            self.wpm = SPEED['MIN']
-        if(1.2/SPEED['MAX'] < mark_dur < 3*1.2/SPEED['MIN']):
-            wpm_new = 1.2/mark_dur if mark_dur < 1.2/SPEED['MIN'] else 3 * 1.2/mark_dur
-            wpm_new = np.clip(wpm_new, SPEED['MIN'], SPEED['MAX'])
-            self.wpm = SPEED['ALPHA'] * wpm_new + (1-SPEED['ALPHA']) * self.wpm
-            tu = 1.2/self.wpm
-            ts = TIMESPEC
-            self.timespec = {'dot_short':ts['DOT_SHORT']*tu, 'dot_long':ts['DOT_LONG']*tu,
-                             'charsep_short':ts['CHARSEP_SHORT']*tu, 'charsep_wordsep':ts['CHARSEP_WORDSEP']*tu}
+        self.word_start = (0, 0)
+        self.word_has_dash = False
+        self.max_code = len(MORSE_TABLE)
+        self.set_speed(SPEED['START'])
+
+    @property
+    def element_buffer(self):
+        return bin(self.element_code)[3:].replace('0', '.').replace('1', '-')
+
+    def set_speed(self, wpm):
+        self.wpm = wpm
+        tu = 1.2/wpm
+        ts = TIMESPEC
+        self.timespec = {'dot_short':ts['DOT_SHORT']*tu, 'dot_long':ts['DOT_LONG']*tu,
+                         'charsep_short':ts['CHARSEP_SHORT']*tu, 'charsep_wordsep':ts['CHARSEP_WORDSEP']*tu}
 
     def complete_character(self):
-        chardefault = self.element_buffer.strip() if self.unknown_chars == 'promote' else ''
-        char = MORSE.get(self.element_buffer.strip(), chardefault)
-        self.text = (self.text + char)[-TICKER_FIELD_LENGTHS['TEXT']:]
+        code = self.element_code
+        self.element_code = 1
+        if(code == 1):
+            return
+        char = self.table[code] if code < self.max_code else ''
+        if(not char and self.unknown_chars == 'promote'):
+            char = bin(code)[3:].replace('0', '.').replace('1', '-')
+        if(char):
+            self.text += char
+            if(self.on_event):
+                self.on_event('char', char)
         if(char or self.unknown_chars != 'hide'):
-            self.morse = (self.morse + self.element_buffer + ' ')[-TICKER_FIELD_LENGTHS['MORSE']:]
-        self.element_buffer = ''
+            self.morse += bin(code)[3:].replace('0', '.').replace('1', '-') + ' '
+            self.word_has_dash = self.word_has_dash or code & (code - 1) != 0
+        if(len(self.text) > 2 * TICKER_FIELD_LENGTHS['TEXT'] or len(self.morse) > 2 * TICKER_FIELD_LENGTHS['MORSE']):
+            self.trim_tickers()
+
+    def trim_tickers(self):
+        cut_morse = max(0, len(self.morse) - TICKER_FIELD_LENGTHS['MORSE'])
+        cut_text = max(0, len(self.text) - TICKER_FIELD_LENGTHS['TEXT'])
+        self.morse, self.text = self.morse[cut_morse:], self.text[cut_text:]
+        self.word_start = (max(0, self.word_start[0] - cut_morse), max(0, self.word_start[1] - cut_text))
 
     def complete_word(self):
         self.complete_character()
-        if self.morse.rstrip().endswith('/'):
+        morse_start, text_start = self.word_start
+        if(len(self.morse) == morse_start):
             return
-        morse_word = self.morse.split('/')[-1].strip()
-        text_word = self.text.split(' ')[-1].strip()
+        text_word = self.text[text_start:].strip()
         invalid = False
-        invalid = invalid or ('-' not in morse_word and text_word not in ['HE','SHE','SEE','HI','ES','S5','ES5'])
+        invalid = invalid or (not self.word_has_dash and text_word not in ['HE','SHE','SEE','HI','ES','S5','ES5'])
         invalid = invalid or (len(text_word) == 1 and text_word not in ['A', 'I'])
         if invalid:
-            self.morse = '/'.join(self.morse.split('/')[:-1])
-            self.text = ' '.join(self.text.split()[:-1])
-        self.morse = self.morse.rstrip() + '/'
-        self.text = self.text + ' '
+            self.morse, self.text = self.morse[:morse_start], self.text[:text_start]
+        else:
+            if text_word and self.on_event:
+                self.on_event('word', text_word)
+            self.morse = self.morse.rstrip() + '/'
+            self.text = self.text + ' '
+        self.word_start = (len(self.morse), len(self.text))
+        self.word_has_dash = False
+        self.trim_tickers()
 
-    def clockstep(self, keypos_new):
-        t = time.time()
-        dur = t - self.key_last_moved
+    def key_moved(self, keypos_new, dur):
         ts = self.timespec
-        if keypos_new != self.keypos:
-            self.key_last_moved = t
-            self.keypos = keypos_new
-            if self.keypos == 'up':
-                if dur > ts['dot_short']:
-                    self.element_buffer = self.element_buffer + ('.' if dur < ts['dot_long'] else '-')
-                    self.update_speed(dur)
-            if(len(self.element_buffer)>self.max_charlen):
+        self.keypos = keypos_new
+        if self.keypos == 'up':
+            if dur > ts['dot_short']:
+                self.element_code = 2 * self.element_code + (dur >= ts['dot_long'])
+        if(self.element_code >= self.max_code):
+            self.complete_character()
+        if self.keypos == 'down':
+            if dur > ts['charsep_short'] and self.element_code > 1:
                 self.complete_character()
-            if self.keypos == 'down':
-                if dur > ts['charsep_short'] and self.element_buffer:
-                    self.complete_character()
-        if dur > ts['charsep_wordsep']:
-            self.key_last_moved = t
-            self.complete_word()
+
+class Decoder_bank:
+
+    def __init__(self, nf, unknown_chars):
+        self.decoders = [TimingDecoder(unknown_chars, lambda event, text, fb=fb: self.emit(fb, event, text)) for fb in range(nf)]
+        self.listeners = []
+        self.t = 0
+        self.active = np.zeros(nf, dtype = bool)
+        self.quality = np.zeros(nf)
+        self.primed = np.zeros(nf, dtype = bool)
+        self.noise = np.zeros(nf)
+        self.sig_max = np.zeros(nf)
+        self.keydown = np.zeros(nf, dtype = bool)
+        self.key_last_moved = np.zeros(nf)
+        self.wordsep = np.array([d.timespec['charsep_wordsep'] for d in self.decoders])
+        self.speed = Speed_estimator(nf)
+        self.n_steps = 0
+
+    def update_speeds(self, live):
+        # every UPDATE_HOPS hops, set the speed of each live decoder from the shared estimator
+        self.n_steps += 1
+        if(self.n_steps % SPEED['UPDATE_HOPS']):
+            return
+        bins = np.nonzero(live)[0]
+        wpms = self.speed.estimate(bins)
+        timed = np.isfinite(wpms)
+        for fb, wpm in zip(bins[timed], wpms[timed]):
+            if(wpm != self.decoders[fb].wpm):
+                self.decoders[fb].set_speed(wpm)
+                self.wordsep[fb] = self.decoders[fb].timespec['charsep_wordsep']
+
+    def emit(self, fbin, event, text):
+        for listener in self.listeners:
+            listener(fbin, event, text)
+
+    def keying(self, pwr):
+        live = self.active & (self.quality > RECENT_QUALITY_SQUELCH_THRESH)
+        new = live & ~self.primed
+        self.sig_max[new], self.noise[new] = pwr[new], pwr[new]/10
+        self.primed |= new
+        self.noise = np.where(live, 0.995 * self.noise + 0.005 * np.minimum(self.noise*1.05, pwr), self.noise)
+        self.sig_max = np.where(live, np.maximum(self.sig_max * 0.995, pwr), self.sig_max)
+        return live, np.where(live, (pwr - self.noise) >= 0.1 * (self.sig_max - self.noise), self.keydown)
+
+    def clockstep(self, pwr, t):
+        self.t = t
+        live, keydown = self.keying(pwr)
+        dur = t - self.key_last_moved
+        moved = np.nonzero(keydown != self.keydown)[0]
+        for fb in moved:
+            self.decoders[fb].key_moved('down' if keydown[fb] else 'up', dur[fb])
+        self.speed.add(moved, dur[moved], ~keydown[moved])
+        self.key_last_moved[moved] = t
+        self.keydown = keydown
+        self.update_speeds(live)
+        for fb in np.nonzero(live & (dur > self.wordsep))[0]:
+            self.key_last_moved[fb] = t
+            self.decoders[fb].complete_word()
+
+@functools.lru_cache(maxsize = None)
+def correl_templates(wpm, hop_secs):
+    # bipolar keying templates (+1 key down, -1 key up) for every character at one speed, sampled
+    # at the hop rate: LEAD_UNITS of space, the elements, then TRAIL_UNITS of character space
+    tu = 1.2 / wpm
+    codes = {}
+    for code, char in MORSE.items():
+        if(len(code) <= CORREL['MAX_ELEMENTS'] and char not in codes.values()):
+            codes[code] = char
+    rows = []
+    for code in codes:
+        units = [-1] * CORREL['LEAD_UNITS']
+        for el in code:
+            units += [1] * (1 if el == '.' else 3) + [-1]
+        units += [-1] * (CORREL['TRAIL_UNITS'] - 1)
+        n = int(round(len(units) * tu / hop_secs))
+        rows.append(np.array(units)[((np.arange(n) + 0.5) * hop_secs / tu).astype(int)])
+    packed = np.array([int('1' + code.replace('.', '0').replace('-', '1'), 2) for code in codes])
+    durs = np.array([len(r) for r in rows]) * hop_secs
+    return rows, packed, durs
+
+class Correl_bank(Decoder_bank):
+    # matched-filter decoding: each hop, the recent power history (dB) of every live bin is
+    # correlated against the template of every character at every speed in one matrix multiply,
+    # keeping the speeds within SPEED_TOL of the bin's speed from the shared Speed_estimator.
+    # The score is the correlation coefficient over each template's length, so it needs no
+    # threshold on the signal level, only a minimum on/off contrast. The best match above THRESH
+    # becomes a candidate, replaced by any better (or longer) match that overlaps it, and is decoded
+    # when a match that starts after a clear gap comes along, or after HOLD_UNITS. A word ends at a
+    # gap of WORDSEP_UNITS before the next character, or when nothing follows for WORD_TIMEOUT_UNITS;
+    # the TimingDecoders are used for text and words
+    def __init__(self, nf, unknown_chars, hop_secs = HOP_MS / 1000):
+        super().__init__(nf, unknown_chars)
+        self.hop_secs = hop_secs
+        rows, packed, durs, wpms = [], [], [], []
+        for wpm in np.geomspace(*CORREL['WPM'], CORREL['N_SPEEDS']):
+            r, p, d = correl_templates(float(wpm), hop_secs)
+            rows += r
+            packed.append(p)
+            durs.append(d)
+            wpms.append(np.full(len(r), wpm))
+        self.hist_len = max(len(r) for r in rows)
+        self.templates = np.zeros((len(rows), self.hist_len), dtype = np.float32)
+        for i, r in enumerate(rows):
+            self.templates[i, -len(r):] = r
+        self.lens = np.array([len(r) for r in rows])
+        self.t_mean = np.array([np.mean(r) for r in rows])
+        self.t_var = self.lens * (1 - self.t_mean**2)
+        self.packed, self.wpms = np.concatenate(packed), np.concatenate(wpms)
+        self.n_elements = np.array([int(p).bit_length() - 1 for p in self.packed])
+        tu = 1.2 / self.wpms
+        self.trail = CORREL['TRAIL_UNITS'] * tu
+        self.first_el = np.concatenate(durs) - CORREL['LEAD_UNITS'] * tu
+        self.hist = np.zeros((nf, 2 * self.hist_len), dtype = np.float32)
+        self.hist_idx = 0
+        self.noise_dB, self.peak_dB = None, None
+        self.mid_dB = np.full(nf, np.nan)
+        self.last_end = np.full(nf, -np.inf)
+        self.word_open = np.zeros(nf, dtype = bool)
+        self.cand = np.full(nf, -1)
+        self.cand_score, self.cand_t = np.zeros(nf), np.zeros(nf)
+
+    def correlate(self, window):
+        # correlation coefficient, on/off contrast and midway level of each row of window against
+        # each template, using the sums over the last lens samples of each row
+        csum = np.cumsum(window[:, ::-1], axis = 1)[:, self.lens - 1]
+        csumsq = np.cumsum(window[:, ::-1]**2, axis = 1)[:, self.lens - 1]
+        cov = window @ self.templates.T - csum * self.t_mean
+        var_x = np.maximum(csumsq - csum**2 / self.lens, 1e-6)
+        slope = cov / self.t_var
+        return cov / np.sqrt(var_x * self.t_var), 2 * slope, csum / self.lens - slope * self.t_mean
+
+    def clockstep(self, pwr, t):
+        self.t = t
+        x = 10 * np.log10(pwr)
+        if(self.noise_dB is None):
+            self.noise_dB, self.peak_dB = x.copy(), x + 10
+        self.noise_dB = np.where(x < self.noise_dB, 0.9 * self.noise_dB + 0.1 * x, self.noise_dB + 0.002)
+        self.peak_dB = np.maximum(self.peak_dB - 0.02, x)
+        i = self.hist_idx
+        self.hist[:, i], self.hist[:, i + self.hist_len] = x, x
+        self.hist_idx = (i + 1) % self.hist_len
+        live = self.active & (self.quality > RECENT_QUALITY_SQUELCH_THRESH)
+        self.mid_dB = np.where(np.isnan(self.mid_dB), (self.noise_dB + self.peak_dB) / 2, self.mid_dB)
+        keydown = live & (x > self.mid_dB)
+        moved = np.nonzero(keydown != self.keydown)[0]
+        self.speed.add(moved, t - self.key_last_moved[moved], ~keydown[moved])
+        self.key_last_moved[moved] = t
+        self.keydown = keydown
+        self.update_speeds(live)
+        # a channel squelched mid-word would hold its last character and word until it came back
+        for fb in np.nonzero(self.active & ~live & (self.word_open | (self.cand >= 0)))[0]:
+            if(self.cand[fb] >= 0):
+                self.commit(fb)
+            self.word_open[fb] = False
+            self.decoders[fb].complete_word()
+        bins = np.nonzero(live)[0]
+        if(len(bins) == 0):
+            return
+        scores, contrast, mid = self.correlate(self.hist[bins, i + 1:i + 1 + self.hist_len])
+        wpm = np.array([self.decoders[fb].wpm for fb in bins], dtype = float)
+        wpm[self.speed.n_runs[bins] < SPEED['MIN_RUNS']] = np.nan
+        scores[np.abs(np.log(self.wpms[None, :] / wpm[:, None])) > np.log(CORREL['SPEED_TOL'])] = -1
+        scores[contrast < CORREL['MIN_CONTRAST_DB']] = -1
+        scores[(t - self.first_el)[None, :] < (self.last_end[bins, None] + 1.2 / self.wpms[None, :])] = -1
+        best = np.argmax(scores + CORREL['ELEMENT_BONUS'] * self.n_elements, axis = 1)
+        best_score = scores[np.arange(len(bins)), best]
+        best_rank = best_score + CORREL['ELEMENT_BONUS'] * self.n_elements[best]
+        best_start = t - self.first_el[best]
+        cand = self.cand[bins]
+        has_cand = cand >= 0
+        follows = has_cand & (best_score > CORREL['THRESH']) & (best_start > self.cand_t[bins] - self.trail[cand] + CORREL['CHARSEP_UNITS'] * 1.2 / self.wpms[cand])
+        held = has_cand & (t - self.cand_t[bins] > CORREL['HOLD_UNITS'] * 1.2 / self.wpms[cand])
+        for j in np.nonzero(follows | held)[0]:
+            if(held[j] or self.gap_is_clear(bins[j], i, t - self.cand_t[bins[j]] + self.trail[cand[j]], t - best_start[j])):
+                self.commit(bins[j])
+        better = (best_score > CORREL['THRESH']) & (best_rank > self.cand_score[bins])
+        better &= best_start >= self.last_end[bins] + 1.2 / self.wpms[best]
+        self.cand[bins[better]], self.cand_score[bins[better]], self.cand_t[bins[better]] = best[better], best_rank[better], t
+        self.mid_dB[bins[better]] = mid[better, best[better]]
+        timeout = CORREL['WORD_TIMEOUT_UNITS'] * 1.2 / np.where(np.isnan(wpm), CORREL['WPM'][0], wpm)
+        for fb in bins[self.word_open[bins] & (t - self.last_end[bins] > timeout) & (self.cand[bins] < 0)]:
+            self.word_open[fb] = False
+            self.decoders[fb].complete_word()
+
+    def gap_is_clear(self, fb, i, secs_from, secs_to):
+        # whether the key was mostly up between two times given as seconds before the latest hop
+        n_from, n_to = int(secs_from / self.hop_secs), int(secs_to / self.hop_secs)
+        if(n_from <= n_to):
+            return True
+        gap = self.hist[fb, i + self.hist_len - n_from + 1:i + self.hist_len - n_to + 1]
+        return np.mean(gap > self.mid_dB[fb]) < CORREL['GAP_MAX_KEYDOWN']
+
+    def commit(self, fb):
+        k, d = self.cand[fb], self.decoders[fb]
+        tu = 1.2 / self.wpms[k]
+        if(self.word_open[fb] and self.cand_t[fb] - self.first_el[k] - self.last_end[fb] > CORREL['WORDSEP_UNITS'] * tu):
+            d.complete_word()
+        d.element_code = int(self.packed[k])
+        d.complete_character()
+        self.last_end[fb] = self.cand_t[fb] - self.trail[k]
+        self.word_open[fb] = True
+        self.cand[fb], self.cand_score[fb] = -1, 0
+
+def make_bank(nf, unknown_chars, decoder = 'timing', hop_secs = HOP_MS / 1000):
+    # hop_secs, the spectrum's true hop, sets the timing of the correlation templates
+    if(decoder == 'correl'):
+        return Correl_bank(nf, unknown_chars, hop_secs)
+    return Decoder_bank(nf, unknown_chars)
 
 class UI_channel:
-    def __init__(self, axs, fbin, ticker, last_updated, unknown_chars):
+    def __init__(self, axs, fbin, ticker, last_updated, bank, waterfall):
         self.ticker = ticker
         self.last_updated = last_updated
         self.axs = axs
-        self.decoder = TimingDecoder(unknown_chars)
-        self.active = False
-        timevals = np.linspace(0, DISPLAY_DUR, int(DISPLAY_DUR * 1000 / HOP_MS))
-        self.keyline_data = np.zeros_like(timevals)
-        self.keyline = self.axs[0].plot(timevals, self.keyline_data, color = 'white', drawstyle='steps-post')[0]
+        self.bank = bank
+        self.decoder = bank.decoders[fbin]
+        timevals = np.linspace(0, DISPLAY_DUR, waterfall.nt)
+        self.keyline_data = waterfall.keylines[fbin]
+        if(self.axs is not None):
+            self.keyline = self.axs[0].plot(timevals, self.keyline_data, color = 'white', drawstyle='steps-post')[0]
         self.fbin = fbin
-        self.quality = 0
-        self.sig_max = None
-        self.noise = None
 
     def start(self):
-        self.active = True
+        self.bank.active[self.fbin] = True
 
     def pause(self):
         self.decoder.complete_word()
-        self.display()
-        self.active = False
-
-    def clockstep(self, sig, waterfall_idx):
-        if self.quality > RECENT_QUALITY_SQUELCH_THRESH:
-            if(self.sig_max is None): self.sig_max = sig
-            if(self.noise is None): self.noise = sig/10
-            self.noise = 0.995 * self.noise + 0.005 * np.minimum(self.noise*1.05, sig)
-            self.sig_max = np.maximum(self.sig_max * 0.995, sig)
-            sig = (sig - self.noise) / (self.sig_max - self.noise)
-            keypos = 'up' if sig <0.1 else 'down'
-            self.decoder.clockstep(keypos)
-        yval = self.fbin + (0.2 if self.decoder.keypos == 'up' else 0.8)  
-        if(WF_MODE == 'wf_wipe'):
-            self.keyline_data[waterfall_idx] = yval
-        else:
-            self.keyline_data[:-1] = self.keyline_data[1:]
-            self.keyline_data[-1] = yval
+        self.bank.active[self.fbin] = False
+        if(self.axs is not None):
+            self.display()
 
-    def display(self):
+    def ticker_text(self):
         d = self.decoder
-        if(self.active):
+        m, t = int(TICKER_FIELD_LENGTHS['MORSE']), int(TICKER_FIELD_LENGTHS['TEXT'])
+        morse = (' ' * m + d.morse + d.element_buffer)[-m:]
+        return f" {d.wpm:3.0f} wpm | {morse:<{m}} | {d.text[-t:]:<{t}}"
+
+    def display(self):
+        if(self.bank.active[self.fbin]):
             self.keyline.set_ydata(self.keyline_data)
             self.keyline.set_linestyle('solid')
         else:
             self.ticker.set_color('black')
             self.keyline.set_linestyle('none')
-        m, t = int(TICKER_FIELD_LENGTHS['MORSE']), int(TICKER_FIELD_LENGTHS['TEXT'])
-        morse = (' ' * m + d.morse + d.element_buffer)[-m:]
-        new_text = f" {d.wpm:3.0f} wpm | {morse:<{m}} | {d.text[-t:]:<{t}}"
+        new_text = self.ticker_text()
         if(self.ticker.get_text() != new_text):
             self.ticker.set_text(new_text)
             self.ticker.set_color('blue')
@@ -212,19 +876,38 @@ class UI_waterfall:
         self.nt = int(DISPLAY_DUR * 1000 / HOP_MS)
         self.idx = 0
         self.data = np.zeros((nf, self.nt))
+        self.keylines = np.zeros((nf, self.nt))
+        self.keyline_base = np.arange(nf) + 0.2
         self.recent_idx = 0
         self.recent_data = np.zeros((nf, WF_RECENT_QUALITY_SQUELCH_LENGTH))
-        self.spec_plot = axs[0].imshow(self.data, origin = 'lower', aspect='auto', alpha = 1,
-                                  vmin = 5,  vmax=25, interpolation = 'bilinear', extent=[0, DISPLAY_DUR, 0, nf])
-    def clockstep(self, newvals):
+        self.recent_sum, self.recent_sumsq = np.zeros(nf), np.zeros(nf)
+        if(axs is not None):
+            self.spec_plot = axs[0].imshow(self.data, origin = 'lower', aspect='auto', alpha = 1,
+                                      vmin = 5,  vmax=25, interpolation = 'bilinear', extent=[0, DISPLAY_DUR, 0, nf])
+    def clockstep(self, newvals, keydown, draw = True):
+        old = self.recent_data[:, self.recent_idx]
+        self.recent_sum += newvals - old
+        self.recent_sumsq += newvals * newvals - old * old
+        old[:] = newvals
+        self.recent_idx = (self.recent_idx + 1) % WF_RECENT_QUALITY_SQUELCH_LENGTH
+        if(self.recent_idx == 0):
+            # resync the running sums once per pass to stop rounding errors accumulating
+            self.recent_sum = np.sum(self.recent_data, axis = 1)
+            self.recent_sumsq = np.sum(self.recent_data * self.recent_data, axis = 1)
+        if(not draw):
+            return
         if(WF_MODE == 'wf_wipe'):
             self.idx = (self.idx + 1) % self.nt
         else:
             self.data[:, :-1] = self.data[:, 1:]
+            self.keylines[:, :-1] = self.keylines[:, 1:]
             self.idx = -1
         self.data[:, self.idx]  = newvals
-        self.recent_data[:, self.recent_idx] = newvals
-        self.recent_idx = (self.recent_idx + 1) % WF_RECENT_QUALITY_SQUELCH_LENGTH
+        self.keylines[:, self.idx] = self.keyline_base + 0.6 * keydown
+
+    def recent_std(self):
+        mean = self.recent_sum / WF_RECENT_QUALITY_SQUELCH_LENGTH
+        return np.sqrt(np.maximum(self.recent_sumsq / WF_RECENT_QUALITY_SQUELCH_LENGTH - mean * mean, 0))
 
     def display(self):
         self.spec_plot.set_array(self.data)
@@ -232,53 +915,266 @@ class UI_waterfall:
         self.spec_plot.set_clim(vmax = vmax, vmin = vmax - 20)
         return self.spec_plot
 
+class Profiler:
+    # per-stage latency histograms with log2-spaced bins: bin k counts durations in [2^(k-1), 2^k) us
+    def __init__(self, n_bins = 24):
+        self.n_bins = n_bins
+        self.hists = {}
+        self.counts = {'hops':0, 'calls':0, 'overruns':0, 'catchups':0, 'wf_skipped':0, 'skipped_hops':0, 'frames':0}
+        self.t_start = time.time()
+
+    def record(self, stage, t0):
+        t1 = time.perf_counter()
+        hist = self.hists.get(stage)
+        if(hist is None):
+            hist = self.hists[stage] = [0] * self.n_bins
+        hist[min(int((t1 - t0) * 1e6).bit_length(), self.n_bins - 1)] += 1
+        return t1
+
+    def snapshot(self):
+        stages = {}
+        for stage, hist in list(self.hists.items()):
+            n, cum = sum(hist), np.cumsum(hist)
+            pct = lambda p: int(2**np.searchsorted(cum, p * n)) if n else 0
+            stages[stage] = {'n':n, 'p50_us':pct(0.5), 'p99_us':pct(0.99), 'max_us':int(2**np.nonzero(hist)[0][-1]) if n else 0,
+                             'hist_us':{int(2**k):c for k, c in enumerate(hist) if c}}
+        return {'uptime_s':round(time.time() - self.t_start, 1), 'counts':dict(self.counts), 'stages':stages}
+
+    def report(self):
+        snap = self.snapshot()
+        lines = [f"[Profiler] {snap['uptime_s']}s " + ' '.join(f"{k}={v}" for k, v in snap['counts'].items())]
+        for stage, st in snap['stages'].items():
+            lines.append(f"[Profiler] {stage:<10} n={st['n']:<8} p50<{st['p50_us']}us p99<{st['p99_us']}us max<{st['max_us']}us")
+        return '\n'.join(lines)
+
+    def dump(self, filename = None):
+        print(self.report(), file = sys.stderr)
+        if(filename):
+            with open(filename, 'w') as f:
+                json.dump(self.snapshot(), f, indent = 1)
+
 class Hot_loop:
-    def __init__(self, spectrum, channels, waterfall):
+    # wakes when the audio ring holds the next hop and processes every hop that has arrived since.
+    # If it falls behind by more than wf_max_backlog hops, the waterfall is drawn on a subset of
+    # them; the decoders only lose hops once the backlog outgrows the ring (spectrum.max_hops).
+    # finished is set once the last hops of a replay have been decoded
+    def __init__(self, spectrum, bank, waterfall, threaded = True, profiler = None, wf_max_backlog = WF_MAX_BACKLOG, recorder = None):
+        self.spectrum, self.bank, self.waterfall = spectrum, bank, waterfall
+        self.recorder = recorder
+        self.profiler = profiler
+        self.wf_max_backlog = wf_max_backlog
         self.data_counter = 0
-        self.abort = False
-        self.last_hop = time.time()
-        threading.Thread(target = self.loop, args = (spectrum, channels, waterfall,) ).start()
+        self.finished = False
+        if(threaded):
+            threading.Thread(target = self.loop, daemon = True).start()
         
-    def loop(self, spectrum, channels, waterfall):
+    def loop(self):
         while True:
-            delay = HOP_MS/1000 - (time.time() - self.last_hop)
-            if(delay > 0):
-                time.sleep(delay)
-            else:
-                self.abort = True
-            self.last_hop = time.time()
-            spectrum.calc_spectrum()
-            pwr_dB = 10*np.log10(spectrum.pwr)
-            waterfall.clockstep(pwr_dB)
-            for ch in channels:
-                if(ch.active):
-                    ch.clockstep(spectrum.pwr[ch.fbin], waterfall.idx)
-            self.data_counter += 1
+            if(self.spectrum.wait_for_hop(timeout = 1)):
+                self.hop()
+
+    def hop(self):
+        spectrum, prof = self.spectrum, self.profiler
+        t_hop = t = time.perf_counter() if prof else 0
+        n_hops = spectrum.calc_spectrum()
+        if(prof): t = prof.record('spectrum', t)
+        if(self.recorder and n_hops):
+            self.recorder.write(self.data_counter + spectrum.skipped_hops, spectrum.t, spectrum.pwr)
+            if(prof): t = prof.record('record', t)
+        pwr_dB = 10*np.log10(spectrum.pwr)
+        if(prof): t = prof.record('log10', t)
+        wf_stride = 1
+        if(self.wf_max_backlog and n_hops > self.wf_max_backlog):
+            wf_stride = -(-n_hops // self.wf_max_backlog)
+        for i in range(n_hops):
+            self.bank.clockstep(spectrum.pwr[i], spectrum.t[i])
+            if(prof): t = prof.record('decoders', t)
+            self.waterfall.clockstep(pwr_dB[i], self.bank.keydown, draw = (n_hops - 1 - i) % wf_stride == 0)
+            if(prof): t = prof.record('waterfall', t)
+        self.data_counter += n_hops
+        self.finished = spectrum.finished
+        if(prof):
+            prof.record('hop', t_hop)
+            c = prof.counts
+            c['calls'] += 1
+            c['hops'] += n_hops
+            c['catchups'] += n_hops > 1
+            c['wf_skipped'] += n_hops - len(range(n_hops - 1, -1, -wf_stride))
+            c['skipped_hops'] = spectrum.skipped_hops
+            if(t - t_hop > max(n_hops, 1) * HOP_MS / 1000):
+                c['overruns'] += 1
+        return n_hops
 
 class Channel_manager:
-    def __init__(self, channels, waterfall, n_decoders):
-        for ch in channels[:n_decoders]:
-            ch.active = True
-        threading.Thread(target = self.loop, args = (channels, waterfall, ) ).start()
+    def __init__(self, channels, waterfall, bank, n_decoders, threaded = True):
+        self.channels, self.waterfall, self.bank = channels, waterfall, bank
+        bank.active[:n_decoders] = True
+        if(threaded):
+            threading.Thread(target = self.loop, daemon = True).start()
         
-    def loop(self, channels, waterfall): 
+    def loop(self): 
         while True:
-            time.sleep(1)
-            quality = np.std(waterfall.recent_data, axis = 1)
-            weakest_decoder = [-1,1e6]
-            for fbin, ch in enumerate(channels):
-                if ch.active:
-                    idx = waterfall.idx
-                    ch.quality = quality[fbin]
-                    if quality[fbin] < weakest_decoder[1]:
-                        weakest_decoder = [fbin, quality[fbin]]
-                    quality[fbin] = 0
-            best_fbin = np.argmax(quality)
-            if not channels[best_fbin].active:
-                channels[best_fbin].start()
-                channels[weakest_decoder[0]].pause()
+            time.sleep(CHANNEL_SWAP['INTERVAL_SECS'])
+            self.update()
+
+    def update(self):
+        # move decoders from the weakest active bins to the strongest inactive bins among the top n,
+        # strongest first, while each swap gains at least HYSTERESIS_DB of quality
+        active = self.bank.active.copy()
+        quality = self.waterfall.recent_std()
+        n = np.count_nonzero(active)
+        if(0 < n < len(active)):
+            top = np.argpartition(quality, -n)[-n:]
+            to_start = top[~active[top]]
+            to_start = to_start[np.argsort(-quality[to_start])]
+            to_stop = np.nonzero(active)[0]
+            to_stop = to_stop[np.argsort(quality[to_stop])]
+            n_swaps = min(len(to_start), CHANNEL_SWAP['MAX_PER_UPDATE'])
+            for fb_start, fb_stop in zip(to_start[:n_swaps], to_stop[:n_swaps]):
+                if(quality[fb_start] < quality[fb_stop] + CHANNEL_SWAP['HYSTERESIS_DB']):
+                    break
+                self.channels[fb_start].start()
+                self.channels[fb_stop].pause()
+        active = self.bank.active
+        self.bank.quality[active] = quality[active]
+
+class Json_events:
+    def __init__(self, spectrum, bank, out = sys.stdout):
+        self.spectrum, self.bank, self.out = spectrum, bank, out
+        bank.listeners.append(self.emit)
+
+    def emit(self, fbin, event, text):
+        d = self.bank.decoders[fbin]
+        rec = {'time':round(time.time(), 3), 't':round(float(self.bank.t), 3), 'event':event, 'text':text, 'fbin':int(fbin),
+               'input':int(self.spectrum.inputs[fbin]), 'freq':float(self.spectrum.freqs[fbin]), 'wpm':round(float(d.wpm), 1), 'quality':round(float(self.bank.quality[fbin]), 2)}
+        self.out.write(json.dumps(rec) + '\n')
+        self.out.flush()
+
+class Spotter:
+    # reports callsigns to PSK Reporter from each channel's words as they are completed: a small
+    # state machine per channel looks for a callsign after CQ/TEST (allowing a few words such as DX
+    # in between) or after DE, matching each word once against a compiled pattern
+    CALLSIGN = re.compile(r"(?:[A-Z0-9]{1,3}/)?(?:[A-Z]{1,2}|[A-Z][0-9]|[0-9][A-Z])[0-9]{1,2}[A-Z]{1,4}(?:/[A-Z0-9]{1,4})?")
+
+    def __init__(self, spectrum, waterfall, bank, pskr, dial = None):
+        self.spectrum, self.waterfall, self.pskr = spectrum, waterfall, pskr
+        self.dial = input_dials(spectrum, dial)
+        self.state = np.zeros(spectrum.nf, dtype = int)
+        self.words_left = np.zeros(spectrum.nf, dtype = int)
+        bank.listeners.append(self.emit)
+
+    def emit(self, fbin, event, text):
+        if(event != 'word'):
+            return
+        if(text in ('CQ', 'TEST', '_CQ_')):
+            self.state[fbin], self.words_left[fbin] = SPOTTER['CQ'], SPOTTER['WORDS_TO_CALL']
+        elif(text == 'DE'):
+            self.state[fbin], self.words_left[fbin] = SPOTTER['DE'], 1
+        elif(self.state[fbin] and self.CALLSIGN.fullmatch(text)):
+            self.pskr.add_report(text, int(self.dial[self.spectrum.inputs[fbin]] + self.spectrum.freqs[fbin]), self.snr(fbin), 'CW', 1, int(time.time()))
+            self.state[fbin] = SPOTTER['IDLE']
+        elif(self.words_left[fbin] > 1):
+            self.words_left[fbin] -= 1
+        else:
+            self.state[fbin] = SPOTTER['IDLE']
+
+    def snr(self, fbin):
+        # the bin's peak over the last DISPLAY_DUR against the median of the whole waterfall, scaled
+        # to the 2500 Hz bandwidth PSK Reporter uses
+        snr = np.max(self.waterfall.data[fbin]) - np.median(self.waterfall.data) - 10 * np.log10(2500 / self.spectrum.params['df'])
+        return int(np.clip(round(snr), -50, 49))
+
+    def close(self):
+        self.pskr.close()
+
+class Decode_log:
+    # a transcript of decoded words, one line each with time, frequency, speed and channel. Lines
+    # are queued by emit() and written in batches by a writer thread, which starts a new file
+    # after MAX_BYTES or ROTATE_SECS and renames (and optionally gzips) the closed one, so the hop
+    # loop never waits on the disk. With audio_clock (a file or replay) lines are stamped with the
+    # time into the audio instead of the UTC time they were decoded
+    def __init__(self, spectrum, bank, filename, compress = False, dial = None, audio_clock = False):
+        self.spectrum, self.bank, self.filename, self.compress = spectrum, bank, filename, compress
+        self.audio_clock = audio_clock
+        self.dial = input_dials(spectrum, dial)
+        self.queue = queue.SimpleQueue()
+        self.open()
+        self.thread = threading.Thread(target = self.loop, daemon = True)
+        self.thread.start()
+        bank.listeners.append(self.emit)
+        print(f"[Decode_log] Logging decoded words to {filename}")
+
+    def emit(self, fbin, event, text):
+        if(event == 'word'):
+            t = float(self.bank.t) if self.audio_clock else time.time()
+            self.queue.put((t, fbin, float(self.bank.decoders[fbin].wpm), text))
+
+    def open(self):
+        self.f = open(self.filename, 'a', encoding = 'utf-8')
+        self.opened = time.time()
+
+    def loop(self):
+        while True:
+            items = [self.queue.get()]
+            time.sleep(DECODE_LOG['FLUSH_SECS'])
+            while not self.queue.empty():
+                items.append(self.queue.get())
+            stop = None in items
+            self.f.write(''.join(self.line(*item) for item in items if item is not None))
+            self.f.flush()
+            if(stop):
+                self.f.close()
+                return
+            if(self.f.tell() > DECODE_LOG['MAX_BYTES'] or time.time() - self.opened > DECODE_LOG['ROTATE_SECS']):
+                self.rotate()
+
+    def line(self, t, fbin, wpm, text):
+        if(self.audio_clock):
+            stamp = f"{int(t // 3600):d}:{int(t // 60 % 60):02d}:{int(t % 60):02d}.{int(t % 1 * 1000):03d}"
+        else:
+            stamp = time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(t)) + f".{int(t % 1 * 1000):03d}"
+        return f"{stamp} {self.dial[self.spectrum.inputs[fbin]] + self.spectrum.freqs[fbin]:10.0f} Hz {wpm:4.1f} wpm {fbin:4d} {text}\n"
+
+    def rotate(self):
+        self.f.close()
+        stem, ext = os.path.splitext(self.filename)
+        base = f"{stem}-{time.strftime('%Y%m%d-%H%M%S', time.gmtime(self.opened))}"
+        closed, n = base + ext, 0
+        while os.path.exists(closed) or os.path.exists(closed + '.gz'):
+            n += 1
+            closed = f"{base}-{n}{ext}"
+        os.replace(self.filename, closed)
+        self.open()
+        if(self.compress):
+            import gzip
+            import shutil
+            with open(closed, 'rb') as f_in, gzip.open(closed + '.gz', 'wb') as f_out:
+                shutil.copyfileobj(f_in, f_out)
+            os.remove(closed)
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join(DECODE_LOG['FLUSH_SECS'] + 5)
+
+def input_dials(spectrum, dial):
+    # the dial frequency of each input: one per -i, or one (0 without --dial) for every input
+    dial = list(dial) if dial else [0]
+    return dial * (int(np.max(spectrum.inputs)) + 1) if len(dial) == 1 else dial
+
+def make_decode_log(spectrum, bank, log, log_compress, dial, audio_clock = False):
+    return Decode_log(spectrum, bank, log, log_compress, dial, audio_clock) if log else None
+
+def make_recorder(spectrum, record):
+    return Spectrum_recorder(spectrum, record) if record else None
+
+def make_spotter(spectrum, waterfall, bank, pskr, dial):
+    if(not pskr):
+        return None
+    mycall, grid = pskr
+    return Spotter(spectrum, waterfall, bank, PSKR_upload(mycall, grid, 'PyMorse', None), dial)
 
 def define_figure(nf):
+    import matplotlib.pyplot as plt
     fig, axs = plt.subplots(1,2, width_ratios=[1, 1], figsize = (12,3))
     fig.set_facecolor("lightgrey")
     ax_wf, ax_tx = axs
@@ -295,43 +1191,201 @@ def define_figure(nf):
     ax_tx.set_axis_off()
     return fig, axs
                     
-def run(input_device_keywords, freq_range, df, n_decoders, unknown_chars):
-    spectrum = Spectrum(input_device_keywords, df,  freq_range)
-    fig, axs = define_figure(spectrum.nf)
-    waterfall = UI_waterfall(axs, spectrum.nf)
-    spec_plot = waterfall.display()
-    channels = [UI_channel(axs, fb, axs[1].text(0, fb, ''), time.time(), unknown_chars) for fb in range(spectrum.nf)]
-    keylines = [ch.keyline for ch in channels]
-    ch_mgr = Channel_manager(channels, waterfall, n_decoders)
-    hot_loop = Hot_loop(spectrum, channels, waterfall)
-
-    def animation_callback(frame):
-        while hot_loop.data_counter < DISPLAY_DECIMATE:
-            time.sleep(0)
-        hot_loop.data_counter = 0
+def make_profiler(profile):
+    if(profile is None):
+        return None
+    profiler = Profiler()
+    atexit.register(profiler.dump, profile or None)
+    if(hasattr(signal, 'SIGUSR1')):
+        signal.signal(signal.SIGUSR1, lambda signum, frame: print(profiler.report(), file = sys.stderr))
+    return profiler
+
+def run(input_device_keywords, opts):
+    profiler = make_profiler(opts.profile)
+    worker = None
+    if(opts.worker):
+        from pymorse.worker import Worker
+        worker = Worker(input_device_keywords, opts)
+        nf, make_channel, hop_count, finished = worker.nf, worker.channel, worker.hop_count, worker.finished
+    else:
+        spectrum = open_spectrum(input_device_keywords, opts.df, opts.freq_range, opts.engine, opts.iq, opts.replay, opts.replay_speed)
+        nf, make_channel = spectrum.nf, UI_channel
+    axs = None
+    if(opts.ui == 'mpl'):
+        import matplotlib.pyplot as plt
+        from matplotlib.animation import FuncAnimation
+        fig, axs = define_figure(nf)
+    waterfall = UI_waterfall(axs, nf)
+    bank = Decoder_bank(nf, opts.unknown_chars) if worker else make_bank(nf, opts.unknown_chars, opts.decoder, spectrum.params['hop_secs'])
+    if(worker):
+        worker.attach(waterfall, bank)
+    tickers = [axs[1].text(0, fb, '') if axs is not None else None for fb in range(nf)]
+    channels = [make_channel(axs, fb, tickers[fb], time.time(), bank, waterfall) for fb in range(nf)]
+    if(not worker):
+        ch_mgr = Channel_manager(channels, waterfall, bank, opts.n_decoders)
+        recorder = make_recorder(spectrum, opts.record)
+        hot_loop = Hot_loop(spectrum, bank, waterfall, profiler = profiler, recorder = recorder)
+        hop_count, finished = lambda: hot_loop.data_counter, lambda: hot_loop.finished
+        spotter = make_spotter(spectrum, waterfall, bank, opts.pskr, opts.dial)
+        decode_log = make_decode_log(spectrum, bank, opts.log, opts.log_compress, opts.dial, audio_clock = bool(opts.replay))
+    if(opts.ui == 'qt'):
+        from pymorse.ui_qt import UI_qt
+        UI_qt(waterfall, bank, channels, profiler = profiler).run()
+    else:
         spec_plot = waterfall.display()
-        for ch in channels:
-            ch.display()                
-        return [spec_plot, *keylines, *axs[1].texts]
+        keylines = [ch.keyline for ch in channels]
+        last_hops = [0]
+
+        def animation_callback(frame):
+            while hop_count() - last_hops[0] < DISPLAY_DECIMATE and not finished():
+                time.sleep(HOP_MS / 4000)
+            last_hops[0] = hop_count()
+            t = time.perf_counter()
+            spec_plot = waterfall.display()
+            for ch in channels:
+                ch.display()                
+            if(profiler):
+                profiler.record('render', t)
+                profiler.counts['frames'] += 1
+            return [spec_plot, *keylines, *axs[1].texts]
 
-    ani = FuncAnimation(plt.gcf(), animation_callback, interval = 30, frames = 100000,  blit = True)
-    plt.show()
+        ani = FuncAnimation(plt.gcf(), animation_callback, interval = 30, frames = 100000,  blit = True)
+        plt.show()
+    if(worker):
+        worker.close()
+        return
+    for sink in (spotter, decode_log, recorder):
+        if(sink):
+            sink.close()
 
-def cli():
+class File_decoder:
+    # with replay set, decodes a recording from Spectrum_recorder instead of audio_file
+    def __init__(self, audio_file, opts, profiler = None):
+        if(opts.replay):
+            self.spectrum = Spectrum_replay(opts.replay, speed = 0)
+            self.advance = self.spectrum.advance
+        else:
+            self.spectrum = Spectrum(None, opts.df, opts.freq_range, audio_file = audio_file, file_rate = opts.file_rate, ring_secs = 4, engine = opts.engine, iq = opts.iq)
+            self.advance = self.spectrum.audio.advance
+        self.waterfall = UI_waterfall(None, self.spectrum.nf)
+        self.bank = make_bank(self.spectrum.nf, opts.unknown_chars, opts.decoder, self.spectrum.params['hop_secs'])
+        self.channels = [UI_channel(None, fb, None, 0, self.bank, self.waterfall) for fb in range(self.spectrum.nf)]
+        self.ch_mgr = Channel_manager(self.channels, self.waterfall, self.bank, opts.n_decoders, threaded = False)
+        self.recorder = make_recorder(self.spectrum, opts.record)
+        self.hot_loop = Hot_loop(self.spectrum, self.bank, self.waterfall, threaded = False, profiler = profiler, wf_max_backlog = None, recorder = self.recorder)
+
+    def run(self):
+        while self.advance():
+            self.hot_loop.hop()
+            self.ch_mgr.update()
+        for fb in np.nonzero(self.bank.active)[0]:
+            self.channels[fb].pause()
+        if(self.recorder):
+            self.recorder.close()
+        return self.spectrum.next_hop_end / self.spectrum.params['sr']
+
+def run_file(audio_file, opts):
+    json_out = sys.stdout
+    if(opts.headless):
+        sys.stdout = sys.stderr
+    fd = File_decoder(audio_file, opts, make_profiler(opts.profile))
+    words = {fb: [] for fb in range(fd.spectrum.nf)}
+    fd.bank.listeners.append(lambda fb, event, text: words[fb].append(text) if event == 'word' else None)
+    if(opts.headless):
+        Json_events(fd.spectrum, fd.bank, json_out)
+    decode_log = make_decode_log(fd.spectrum, fd.bank, opts.log, opts.log_compress, opts.dial, audio_clock = True)
+    t0 = time.time()
+    audio_secs = fd.run()
+    if(decode_log):
+        decode_log.close()
+    print(f"[File] Decoded {audio_secs:.1f}s of audio in {time.time() - t0:.1f}s")
+    if(opts.headless):
+        return
+    for fb, w in words.items():
+        if(w):
+            print(f"{fd.spectrum.freqs[fb]:5.0f} Hz: {' '.join(w)}")
+
+def run_headless(input_device_keywords, opts):
+    json_out, sys.stdout = sys.stdout, sys.stderr
+    profiler = make_profiler(opts.profile)
+    spectrum = open_spectrum(input_device_keywords, opts.df, opts.freq_range, opts.engine, opts.iq, opts.replay, opts.replay_speed)
+    waterfall = UI_waterfall(None, spectrum.nf)
+    bank = make_bank(spectrum.nf, opts.unknown_chars, opts.decoder, spectrum.params['hop_secs'])
+    channels = [UI_channel(None, fb, None, 0, bank, waterfall) for fb in range(spectrum.nf)]
+    Json_events(spectrum, bank, json_out)
+    spotter = make_spotter(spectrum, waterfall, bank, opts.pskr, opts.dial)
+    decode_log = make_decode_log(spectrum, bank, opts.log, opts.log_compress, opts.dial, audio_clock = bool(opts.replay))
+    ch_mgr = Channel_manager(channels, waterfall, bank, opts.n_decoders)
+    recorder = make_recorder(spectrum, opts.record)
+    hot_loop = Hot_loop(spectrum, bank, waterfall, profiler = profiler, recorder = recorder)
+    # SIGTERM (systemd, docker) stops as Ctrl-C does, so pending spots and log lines are written
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        while not hot_loop.finished:
+            time.sleep(0.1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for fb in np.nonzero(bank.active)[0]:
+            channels[fb].pause()
+        for sink in (spotter, decode_log, recorder):
+            if(sink):
+                sink.close()
+
+def make_parser():
     parser = argparse.ArgumentParser(prog='PyMorseRx', description = 'Command Line Morse decoder')
 
-    parser.add_argument('-i', '--inputcard_keywords', help = 'Comma-separated keywords to identify the input sound device', default = "Mic, CODEC") 
-    parser.add_argument('-df', '--df', help = 'Frequency step, Hz', default = 40) 
-    parser.add_argument('-fr', '--freq_range', help = 'Frequency range Hz e.g. [600,800]', default = [200, 800]) 
-    parser.add_argument('-n', '--n_decoders', help = 'Number of decoders', default = 3) 
-    parser.add_argument('-u','--unknown_chars', help = 'Action on unknown character', nargs = '?', choices = ['keep','hide','promote'], default = 'hide', const = 'hide') 
-    
+    parser.add_argument('-i', '--inputcard_keywords', help = 'Comma-separated keywords to identify the input sound device; repeat to decode several devices at once', action = 'append') 
+    parser.add_argument('-df', '--df', help = 'Frequency step, Hz', type = float, default = 40) 
+    parser.add_argument('-fr', '--freq_range', help = 'Frequency range Hz e.g. [600,800]', type = lambda s: [float(f) for f in s.strip('[]').split(',')], default = [200, 800]) 
+    parser.add_argument('-n', '--n_decoders', help = 'Number of decoders', type = int, default = 3) 
+    parser.add_argument('-u','--unknown_chars', help = 'Action on unknown character: keep or hide its elements in the ticker, promote them into the text, or replace it with the nearest known character', nargs = '?', choices = ['keep','hide','promote','nearest'], default = 'hide', const = 'hide') 
+    parser.add_argument('-f', '--file', help = 'Decode a WAV or raw int16 file (- for stdin) instead of the sound card, as fast as possible') 
+    parser.add_argument('--iq', help = 'Input is complex baseband: interleaved I/Q samples of this type in a raw file, or a stereo WAV file or sound card. The frequency range is then relative to the centre, and may be negative, e.g. -fr=-3000,3000', nargs = '?', choices = ['int16','float32'], const = 'int16') 
+    parser.add_argument('--file_rate', help = 'Sample rate of a raw int16 file, Hz', type = int) 
+    parser.add_argument('--headless', help = 'No display: write one JSON line per decoded character or word to stdout', action = 'store_true') 
+    parser.add_argument('--ui', help = 'Display backend: matplotlib or pyqtgraph', choices = ['mpl','qt'], default = 'mpl') 
+    parser.add_argument('--worker', help = 'Run audio input, spectrum and decoders in a separate process from the display', action = 'store_true') 
+    parser.add_argument('--profile', help = 'Time each processing stage and print a summary on exit (and on SIGUSR1); optionally also save it as JSON to the given file', nargs = '?', const = '', default = None) 
+    parser.add_argument('-d', '--decoder', help = 'Decoder: timing thresholds the keying and times the elements, correl matches whole characters against templates at every speed at more CPU', choices = ['timing','correl'], default = 'timing') 
+    parser.add_argument('--pskr', help = 'Report callsigns heard calling CQ or after DE to PSK Reporter as MYCALL,LOCATOR', type = lambda s: s.upper().replace(' ','').split(','))
+    parser.add_argument('--dial', help = 'Receiver dial frequency, Hz, added to the audio frequency of each spot and log line; repeat for each -i, in the same order', type = float, action = 'append')
+    parser.add_argument('--log', help = 'Append each decoded word with its time, frequency and speed to this file, starting a new file daily or at 10 MB')
+    parser.add_argument('--log_compress', help = 'Gzip each closed log file', action = 'store_true')
+    parser.add_argument('--record', help = f"Record the spectrum of each hop, as the decoders see it, to this .npy file (up to {RECORD['MAX_SECS']}s)")
+    parser.add_argument('--replay', help = 'Decode a spectrum recorded with --record instead of the sound card or file')
+    parser.add_argument('--replay_speed', help = 'Replay speed as a multiple of real time, or 0 to decode as fast as possible', type = float, default = 1)
+    parser.add_argument('-e', '--engine', help = 'Spectrum engine: fft transforms the whole band; sdft computes only the bins in the frequency range, about twice as fast as fft with up to a few dozen bins when hops are batched (--file, catching up) but slower with hundreds; pfb is a polyphase filterbank for many narrow channels', choices = ['fft','sdft','pfb'], default = 'fft') 
+    return parser
+
+def options(**kwargs):
+    # the command line defaults with kwargs in their place, for calling run, run_file or File_decoder from code
+    opts = make_parser().parse_args([])
+    vars(opts).update(kwargs)
+    return opts
+
+def cli():
+    parser = make_parser()
     args = parser.parse_args()
-    input_device_keywords = args.inputcard_keywords.replace(' ','').split(',')
-    run(input_device_keywords, args.freq_range, args.df, args.n_decoders, args.unknown_chars)
+    if(args.pskr and len(args.pskr) != 2):
+        parser.error("--pskr takes MYCALL,LOCATOR")
+    if(args.pskr and args.replay):
+        parser.error("--pskr can't be used with --replay: spots from a recording would be reported as heard now")
+    if(args.pskr and not args.dial):
+        parser.error("--pskr needs the receiver's --dial frequency, so that spots are on the right band")
+    if(args.dial and not (args.file or args.replay) and len(args.dial) != len(args.inputcard_keywords or [None])):
+        parser.error("give one --dial for each -i, in the same order")
+    if(args.file or (args.replay and not args.replay_speed)):
+        run_file(args.file, args)
+        return
+    input_device_keywords = [kw.replace(' ','').split(',') for kw in args.inputcard_keywords or ["Mic, CODEC"]]
+    if(args.headless):
+        run_headless(input_device_keywords, args)
+        return
+    run(input_device_keywords, args)
 
 if __name__ == '__main__':
-    run(['Mic', 'CODEC'], [200,800], df = 40, n_decoders = 3, unknown_chars = 'keep')
+    run(['Mic', 'CODEC'], options(unknown_chars = 'keep'))
 
 
 
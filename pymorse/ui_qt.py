@@ -0,0 +1,65 @@
+import numpy as np
+import time
+import pyqtgraph as pg
+from pyqtgraph.Qt import QtCore
+from pymorse.pymorse import DISPLAY_DUR
+
+class UI_qt:
+    def __init__(self, waterfall, bank, channels, interval_ms = 20, profiler = None):
+        self.waterfall, self.bank, self.channels = waterfall, bank, channels
+        self.profiler = profiler
+        nf = len(channels)
+        self.app = pg.mkQApp("PyMorse by G1OJS")
+        pg.setConfigOptions(background = 'lightgrey', foreground = 'k')
+        self.widg = pg.GraphicsLayoutWidget(title = "PyMorse by G1OJS")
+        self.widg.resize(1200, 300)
+        ax_wf = self.widg.addPlot()
+        ax_tx = self.widg.addPlot()
+        for ax in (ax_wf, ax_tx):
+            ax.hideAxis('left')
+            ax.hideAxis('bottom')
+            ax.setMouseEnabled(False, False)
+            ax.hideButtons()
+        self.spec_plot = pg.ImageItem(axisOrder = 'row-major')
+        self.spec_plot.setColorMap(pg.colormap.get('viridis'))
+        self.spec_plot.setRect(0, 0, DISPLAY_DUR, nf)
+        ax_wf.addItem(self.spec_plot)
+        ax_wf.setRange(xRange = (0, DISPLAY_DUR), yRange = (0, nf), padding = 0)
+        self.timevals = np.linspace(0, DISPLAY_DUR, waterfall.nt)
+        self.keylines = [ax_wf.plot(self.timevals, waterfall.keylines[fb], pen = 'w') for fb in range(nf)]
+        ax_tx.setRange(xRange = (0, 1), yRange = (0, nf), padding = 0)
+        self.tickers = []
+        for fb in range(nf):
+            ticker = pg.TextItem('', color = 'k', anchor = (0, 0.5))
+            ticker.setPos(0, fb + 0.5)
+            ax_tx.addItem(ticker)
+            self.tickers.append(ticker)
+        self.ticker_texts = [''] * nf
+        self.timer = QtCore.QTimer()
+        self.timer.timeout.connect(self.update)
+        self.timer.start(interval_ms)
+
+    def update(self):
+        t = time.perf_counter()
+        data = self.waterfall.data
+        vmax = np.max(data)
+        self.spec_plot.setImage(data, autoLevels = False, levels = (vmax - 20, vmax))
+        for fb, ch in enumerate(self.channels):
+            active = bool(self.bank.active[fb])
+            self.keylines[fb].setVisible(active)
+            if(active):
+                self.keylines[fb].setData(self.timevals, ch.keyline_data)
+            new_text = ch.ticker_text()
+            if(new_text != self.ticker_texts[fb]):
+                self.ticker_texts[fb] = new_text
+                self.tickers[fb].setText(new_text)
+                self.tickers[fb].setColor('b')
+            elif(not active):
+                self.tickers[fb].setColor('k')
+        if(self.profiler):
+            self.profiler.record('render', t)
+            self.profiler.counts['frames'] += 1
+
+    def run(self):
+        self.widg.show()
+        self.app.exec()
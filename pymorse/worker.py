@@ -0,0 +1,121 @@
+import numpy as np
+import multiprocessing
+from multiprocessing import shared_memory
+from pymorse.pymorse import HOP_MS, DISPLAY_DECIMATE, open_spectrum, UI_waterfall, make_bank, UI_channel, Channel_manager, Hot_loop, Profiler, make_spotter, make_decode_log, make_recorder
+
+TICKER_LEN = 96
+
+class Shared_display:
+    # everything the display reads, in one shared memory block: the waterfall ring and keylines
+    # (written column by column by the hot loop), channel activity, ticker text and the hop count
+    def __init__(self, nf, nt, name = None):
+        fields = [('data', (nf, nt), np.float64), ('keylines', (nf, nt), np.float64), ('hops', (1,), np.int64),
+                  ('text', (nf,), f"U{TICKER_LEN}"), ('active', (nf,), bool)]
+        size = sum(int(np.prod(shape)) * np.dtype(dtype).itemsize for field, shape, dtype in fields)
+        self.shm = shared_memory.SharedMemory(name = name, create = name is None, size = size)
+        offset = 0
+        for field, shape, dtype in fields:
+            arr = np.ndarray(shape, dtype, buffer = self.shm.buf, offset = offset)
+            setattr(self, field, arr)
+            offset += arr.nbytes
+        if(name is None):
+            self.data[:], self.keylines[:], self.hops[:], self.text[:], self.active[:] = 0, 0, 0, '', False
+
+    def attach(self, waterfall, bank):
+        waterfall.data, waterfall.keylines, bank.active = self.data, self.keylines, self.active
+
+    def close(self, unlink = False):
+        for field in ('data', 'keylines', 'hops', 'text', 'active'):
+            delattr(self, field)
+        self.shm.close()
+        if(unlink):
+            self.shm.unlink()
+
+class Shared_channel(UI_channel):
+    def __init__(self, shared, *args):
+        self.shared = shared
+        super().__init__(*args)
+
+    def ticker_text(self):
+        return str(self.shared.text[self.fbin])
+
+def worker_main(conn, input_device_keywords, opts):
+    profiler = Profiler() if opts.profile is not None else None
+    spectrum = open_spectrum(input_device_keywords, opts.df, opts.freq_range, opts.engine, opts.iq, opts.replay, opts.replay_speed)
+    waterfall = UI_waterfall(None, spectrum.nf)
+    bank = make_bank(spectrum.nf, opts.unknown_chars, opts.decoder, spectrum.params['hop_secs'])
+    shared = Shared_display(spectrum.nf, waterfall.nt)
+    shared.attach(waterfall, bank)
+    channels = [UI_channel(None, fb, None, 0, bank, waterfall) for fb in range(spectrum.nf)]
+    ch_mgr = Channel_manager(channels, waterfall, bank, opts.n_decoders)
+    recorder = make_recorder(spectrum, opts.record)
+    hot_loop = Hot_loop(spectrum, bank, waterfall, profiler = profiler, recorder = recorder)
+    spotter = make_spotter(spectrum, waterfall, bank, opts.pskr, opts.dial)
+    decode_log = make_decode_log(spectrum, bank, opts.log, opts.log_compress, opts.dial, audio_clock = bool(opts.replay))
+    conn.send((shared.shm.name, spectrum.nf, waterfall.nt))
+    # runs until the display stops it or a replay has been decoded to the end
+    while not (conn.poll(DISPLAY_DECIMATE * HOP_MS / 1000) or hot_loop.finished):
+        shared.text[:] = [ch.ticker_text()[:TICKER_LEN] for ch in channels]
+        shared.hops[0] = hot_loop.data_counter
+    for fb in np.nonzero(bank.active)[0]:
+        channels[fb].pause()
+    shared.text[:] = [ch.ticker_text()[:TICKER_LEN] for ch in channels]
+    for sink in (spotter, decode_log, recorder):
+        if(sink):
+            sink.close()
+    if(profiler):
+        profiler.dump(opts.profile.replace('.json', '') + '_worker.json' if opts.profile else None)
+    shared.close(unlink = True)
+
+class Worker:
+    # runs audio input, spectrum, decoders and channel management in a separate process so that
+    # rendering in this one can never hold up the hot loop
+    def __init__(self, input_device_keywords, opts):
+        ctx = multiprocessing.get_context('spawn')
+        self.conn, child_conn = ctx.Pipe()
+        self.proc = ctx.Process(target = worker_main, daemon = True,
+                                args = (child_conn, input_device_keywords, opts))
+        self.proc.start()
+        try:
+            name, self.nf, nt = self.conn.recv()
+        except EOFError:
+            raise RuntimeError("[Worker] Worker process failed to start")
+        self.shared = Shared_display(self.nf, nt, name)
+        self.exited = False
+        print(f"[Worker] Decoding in process {self.proc.pid}")
+
+    def attach(self, waterfall, bank):
+        self.shared.attach(waterfall, bank)
+
+    def channel(self, *args):
+        return Shared_channel(self.shared, *args)
+
+    def hop_count(self):
+        return int(self.shared.hops[0])
+
+    def finished(self):
+        # the display keeps the last frame once the worker has exited, reported once
+        if(self.proc.is_alive()):
+            return False
+        if(not self.exited):
+            print(f"[Worker] Worker process exited with code {self.proc.exitcode}")
+            self.exited = True
+        return True
+
+    def close(self):
+        if(self.proc.is_alive()):
+            self.conn.send('stop')
+        self.proc.join(5)
+        if(self.proc.is_alive()):
+            print("[Worker] Worker process didn't stop, terminating it")
+            self.proc.terminate()
+            self.proc.join(5)
+            if(self.proc.is_alive()):
+                self.proc.kill()
+                self.proc.join()
+        if(self.proc.exitcode != 0):
+            # a worker that died or was terminated may not have removed the shared block
+            try:
+                self.shared.shm.unlink()
+            except FileNotFoundError:
+                pass
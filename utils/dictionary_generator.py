@@ -1,9 +1,13 @@
+# Generates pymorse/morse_table.py: run from the repository root with
+#   python utils/dictionary_generator.py
+
 MORSE = {'.-': 'A', '-...': 'B', '-.-.': 'C', '-..': 'D', '.': 'E', '..-.': 'F', '--.': 'G', '....': 'H', '..': 'I', '.---': 'J',
          '-.-': 'K', '.-..': 'L', '--': 'M', '-.': 'N', '---': 'O', '.--.': 'P', '--.-': 'Q', '.-.': 'R', '...': 'S', '-': 'T',
          '..-': 'U', '...-': 'V', '.--': 'W', '-..-': 'X', '-.--': 'Y', '--..': 'Z',
          '-----': '0', '.----': '1', '..---': '2', '...--': '3', '....-': '4', '.....': '5',
-         '-....': '6', '--...': '7', '---..': '8', '----.': '9','-..-.': '/', '..--': 'Ü', '-.-.-': '_AR_', 
+         '-....': '6', '--...': '7', '---..': '8', '----.': '9','-..-.': '/', '..--': 'Ü', '-.-.-': '_AR_',
          '.-.-.': '_AR_', '..--..': '?', '-...-': '_BK_', '...-.-': '_SK_', '..-.-.': '_UR_', '-.--.': '_KN_', '-.-.--.-': '_CQ_'}
+NEAREST_MAX_ERRORS = 2
 
 MORSE_ERR_CORRECT = {}
 for k, v in MORSE.items():
@@ -14,11 +18,49 @@ for k, v in MORSE.items():
                 #print (v, k, err, MORSE.get(err,''))
                 MORSE_ERR_CORRECT[err] = v
 
+BASE = MORSE
 MORSE = MORSE | MORSE_ERR_CORRECT
+MAX_LEN = max(len(k) for k in MORSE)
+
+def pack(code):
+    # elements as bits (dash = 1) below a leading 1 that marks the length, so that every code up to
+    # MAX_LEN elements has its own index into a flat table of 2**(MAX_LEN + 1) entries
+    return int('1' + code.replace('.', '0').replace('-', '1'), 2)
+
+def unpack(idx):
+    return bin(idx)[3:].replace('0', '.').replace('1', '-')
+
+MORSE_TABLE = [''] * 2**(MAX_LEN + 1)
+for k, v in MORSE.items():
+    MORSE_TABLE[pack(k)] = v
+
+# unknown codes with a unique nearest base code of the same length, within NEAREST_MAX_ERRORS elements
+MORSE_NEAREST = list(MORSE_TABLE)
+for idx in range(2, len(MORSE_TABLE)):
+    if(MORSE_TABLE[idx]):
+        continue
+    code = unpack(idx)
+    dists = {}
+    for k, v in BASE.items():
+        if(len(k) == len(code)):
+            dists.setdefault(sum(a != b for a, b in zip(k, code)), set()).add(v)
+    if(dists):
+        d = min(dists)
+        if(d <= NEAREST_MAX_ERRORS and len(dists[d]) == 1):
+            MORSE_NEAREST[idx] = dists[d].pop()
+
+def table_lines(table, per_line = 16):
+    return [' '.join(f"'{v}'," for v in table[i:i + per_line]) for i in range(0, len(table), per_line)]
 
-s = ''
-for i, kv in enumerate(MORSE.items()):
-    s = s + f"'{kv[0]}': '{kv[1]}', "
-    if((i+1) %10 == 0):
-        print(s)
-        s = ''
+if __name__ == '__main__':
+    lines = ["# Generated by utils/dictionary_generator.py - do not edit", "", f"MORSE_MAX_LEN = {MAX_LEN}", "", "MORSE = {"]
+    items = list(MORSE.items())
+    lines += [' '.join(f"'{k}': '{v}'," for k, v in items[i:i + 10]) for i in range(0, len(items), 10)]
+    lines += ["}", "", "# MORSE indexed by packed code: elements as bits (dash = 1) below a leading 1", "MORSE_TABLE = ["]
+    lines += table_lines(MORSE_TABLE)
+    lines += ["]", "", f"# MORSE_TABLE plus unknown codes matched to a unique nearest code within {NEAREST_MAX_ERRORS} elements", "MORSE_NEAREST = ["]
+    lines += table_lines(MORSE_NEAREST)
+    lines += ["]", ""]
+    with open('pymorse/morse_table.py', 'w', encoding = 'utf-8') as f:
+        f.write('\n'.join(lines))
+    print(f"Wrote pymorse/morse_table.py: {len(MORSE)} codes, {sum(map(bool, MORSE_NEAREST)) - len(MORSE)} nearest-code matches")